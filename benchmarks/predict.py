@@ -0,0 +1,171 @@
+# How fast is predicting slug layouts compared to shaping with the flow font,
+# and does it get the same answers? This builds flow fonts from a synthetic
+# UFO, shapes a corpus with the original font to get its glyphs, and then
+# measures the corpus both by shaping it with the flow font and with
+# SlugLayout.predict(). Any text where the two disagree on the advance width,
+# the number of pills or the number of blanked words is a mismatch.
+#
+#   python benchmarks/predict.py --texts 10000
+#
+# Needs uharfbuzz and numpy, which flowify itself doesn't.
+import argparse
+import io
+import random
+import time
+
+from flowify import Flowify
+from ufo2ft import compileTTF
+from ufoLib2 import Font
+from ufoLib2.objects import Glyph
+
+try:
+    import uharfbuzz as hb
+except ImportError:
+    raise SystemExit("The prediction benchmark needs uharfbuzz: pip install uharfbuzz")
+
+CONFIGS = {
+    "pill": {},
+    "pill-no-blank": {"no_blank": True},
+    "pill-binary": {"output": "binary"},
+    "pill-classes": {"kerning": "classes", "kern_grid": 10},
+    "pill-debugging": {"debugging": True},
+    "rectangle": {"shape": "rectangle"},
+}
+
+parser = argparse.ArgumentParser(
+    description="Check and time slug layout prediction against shaping."
+)
+parser.add_argument("--glyphs", default=100, type=int, help="Number of glyphs")
+parser.add_argument("--kern-pairs", default=500, type=int, help="Number of kern pairs")
+parser.add_argument(
+    "--texts", default=2000, type=int, help="Number of text boxes in the corpus"
+)
+parser.add_argument("--seed", default=1, type=int, help="Random seed")
+parser.add_argument(
+    "--config",
+    action="append",
+    choices=CONFIGS.keys(),
+    help="Only run this configuration (may be given more than once)",
+)
+args = parser.parse_args()
+
+
+# Like the shaping benchmark's font, but with kerning groups and a combining
+# mark, so that everything the prediction knows about gets a look in.
+def make_ufo():
+    random.seed(args.seed)
+    font = Font()
+    font.info.familyName = "Benchmark"
+    font.info.styleName = "Regular"
+    font.info.unitsPerEm = 1000
+    font.info.xHeight = 500
+    font.info.capHeight = 700
+    font.info.ascender = 800
+    font.info.descender = -200
+    font.addGlyph(Glyph(".notdef", width=500))
+    font.addGlyph(Glyph("space", width=250, unicodes=[0x20]))
+    font.addGlyph(Glyph("acutecomb", width=0, unicodes=[0x301]))
+    font.lib["public.openTypeCategories"] = {"acutecomb": "mark"}
+    names = []
+    for i in range(args.glyphs):
+        glyph = Glyph("glyph%i" % i, width=random.randint(50, 800), unicodes=[0x4E00 + i])
+        pen = glyph.getPen()
+        pen.moveTo((0, 0))
+        pen.lineTo((glyph.width, 0))
+        pen.lineTo((glyph.width, 500))
+        pen.closePath()
+        font.addGlyph(glyph)
+        names.append(glyph.name)
+    font.groups["public.kern1.left"] = names[:10]
+    font.groups["public.kern2.right"] = names[10:20]
+    font.kerning[("public.kern1.left", "public.kern2.right")] = -30
+    font.kerning[("public.kern1.left", names[15])] = 25
+    pairs = set()
+    while len(pairs) < min(args.kern_pairs, len(names) ** 2):
+        pairs.add((random.choice(names), random.choice(names)))
+    for pair in sorted(pairs):
+        font.kerning[pair] = random.randint(-120, 60)
+    return font
+
+
+def make_corpus(font):
+    random.seed(args.seed)
+    chars = [chr(g.unicodes[0]) for g in font if g.unicodes and g.name != "space"]
+    return [
+        " ".join(
+            "".join(random.choice(chars) for _ in range(random.randint(1, 10)))
+            for _ in range(random.randint(1, 5))
+        )
+        for _ in range(args.texts)
+    ]
+
+
+def shaper(ttfont):
+    buf = io.BytesIO()
+    ttfont.save(buf)
+    hbfont = hb.Font(hb.Face(buf.getvalue()))
+    order = ttfont.getGlyphOrder()
+
+    def shape(text):
+        buf = hb.Buffer()
+        buf.add_str(text)
+        buf.guess_segment_properties()
+        hb.shape(hbfont, buf)
+        return (
+            [order[info.codepoint] for info in buf.glyph_infos],
+            sum(pos.x_advance for pos in buf.glyph_positions),
+        )
+
+    return shape
+
+
+corpus = make_corpus(make_ufo())
+original = shaper(compileTTF(make_ufo()))
+sequences = [original(text)[0] for text in corpus]
+print(
+    "%-16s %12s %12s %10s" % ("config", "shaped/s", "predicted/s", "mismatches")
+)
+
+for name in args.config or CONFIGS.keys():
+    options = CONFIGS[name]
+    font = make_ufo()
+    flowify = Flowify(font, **options)
+    ttfont = compileTTF(font)
+    if options.get("output") == "binary":
+        flowify.add_to_binary_font(ttfont)
+    shape = shaper(ttfont)
+
+    start = time.perf_counter()
+    shaped = [shape(text) for text in corpus]
+    shaping_time = time.perf_counter() - start
+
+    layout = flowify.slug_layout()
+    layout.glyph_arrays()
+    start = time.perf_counter()
+    predicted = layout.predict(sequences)
+    prediction_time = time.perf_counter() - start
+
+    pills = [0] * len(corpus)
+    blanks = [0] * len(corpus)
+    for sequence, kind in zip(predicted["word_sequence"], predicted["shape"]):
+        if kind == "pill":
+            pills[sequence] += 1
+        elif kind == "blank":
+            blanks[sequence] += 1
+    mismatches = 0
+    for i, (glyphs, advance) in enumerate(shaped):
+        if (
+            advance != predicted["advance"][i]
+            or glyphs.count("slug.left") != pills[i]
+            or sum(g.endswith("E0.blank") for g in glyphs) != blanks[i]
+        ):
+            mismatches += 1
+    print(
+        "%-16s %12.0f %12.0f %10i"
+        % (
+            name,
+            len(corpus) / shaping_time,
+            len(corpus) / prediction_time,
+            mismatches,
+        )
+    )
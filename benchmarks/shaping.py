@@ -0,0 +1,192 @@
+# How expensive are flow fonts to shape? This builds flow fonts from
+# synthetic UFOs, compiles them, shapes a fixed corpus with HarfBuzz and
+# reports the numbers for each set of options. "lookups/g" is the number of
+# lookups which HarfBuzz applied to each buffer (GSUB and GPOS), divided by
+# the number of characters in it. "lookups/text" is the average number of
+# lookups applied to each text box; each of those is a pass over every glyph
+# in the box, however long it is.
+#
+#   python benchmarks/shaping.py --glyphs 200 --kern-pairs 2000
+#
+# Needs uharfbuzz, which flowify itself doesn't.
+import argparse
+import io
+import random
+import time
+
+from flowify import Flowify
+from ufo2ft import compileTTF
+from ufoLib2 import Font
+from ufoLib2.objects import Glyph
+
+try:
+    import uharfbuzz as hb
+except ImportError:
+    raise SystemExit("The shaping benchmark needs uharfbuzz: pip install uharfbuzz")
+
+CONFIGS = {
+    "pill": {},
+    "pill-no-blank": {"no_blank": True},
+    "pill-debugging": {"debugging": True},
+    "pill-binary": {"output": "binary"},
+    "pill-fused": {"pipeline": "fused"},
+    "rectangle": {"shape": "rectangle"},
+    "rectangle-fast": {"shape": "rectangle", "engine": "fast", "no_blank": True},
+}
+
+WIDTHS = {
+    "uniform": lambda: random.randint(200, 800),
+    "few": lambda: random.choice([250, 500, 600, 750]),
+    "mono": lambda: 600,
+}
+
+parser = argparse.ArgumentParser(description="Benchmark the shaping cost of flow fonts.")
+parser.add_argument("--glyphs", default=100, type=int, help="Number of glyphs")
+parser.add_argument(
+    "--widths",
+    default="uniform",
+    choices=WIDTHS.keys(),
+    help="Distribution of advance widths",
+)
+parser.add_argument("--kern-pairs", default=500, type=int, help="Number of kern pairs")
+parser.add_argument(
+    "--texts", default=1000, type=int, help="Number of text boxes in the corpus"
+)
+parser.add_argument(
+    "--words",
+    default=5,
+    type=int,
+    help="Most words in each text box (use a few hundred for long paragraphs)",
+)
+parser.add_argument(
+    "--repeat", default=3, type=int, help="How many times to shape the corpus"
+)
+parser.add_argument("--seed", default=1, type=int, help="Random seed")
+parser.add_argument(
+    "--config",
+    action="append",
+    choices=CONFIGS.keys(),
+    help="Only run this configuration (may be given more than once)",
+)
+args = parser.parse_args()
+
+
+def make_ufo():
+    random.seed(args.seed)
+    font = Font()
+    font.info.familyName = "Benchmark"
+    font.info.styleName = "Regular"
+    font.info.unitsPerEm = 1000
+    font.info.xHeight = 500
+    font.info.capHeight = 700
+    font.info.ascender = 800
+    font.info.descender = -200
+    font.addGlyph(Glyph(".notdef", width=500))
+    font.addGlyph(Glyph("space", width=250, unicodes=[0x20]))
+    names = []
+    for i in range(args.glyphs):
+        glyph = Glyph("glyph%i" % i, width=WIDTHS[args.widths](), unicodes=[0x4E00 + i])
+        pen = glyph.getPen()
+        pen.moveTo((50, 0))
+        pen.lineTo((glyph.width - 50, 0))
+        pen.lineTo((glyph.width - 50, 500))
+        pen.lineTo((50, 500))
+        pen.closePath()
+        font.addGlyph(glyph)
+        names.append(glyph.name)
+    pairs = set()
+    while len(pairs) < min(args.kern_pairs, len(names) ** 2):
+        pairs.add((random.choice(names), random.choice(names)))
+    for pair in sorted(pairs):
+        font.kerning[pair] = random.choice([-80, -40, -20, -10, 10, 20, 40])
+    return font
+
+
+# A fixed corpus: text boxes of up to --words words, each of one to ten glyphs.
+def make_corpus(font):
+    random.seed(args.seed)
+    chars = [chr(g.unicodes[0]) for g in font if g.unicodes and g.name != "space"]
+    return [
+        " ".join(
+            "".join(random.choice(chars) for _ in range(random.randint(1, 10)))
+            for _ in range(random.randint(1, args.words))
+        )
+        for _ in range(args.texts)
+    ]
+
+
+def shape(hbfont, text, messages=None):
+    buf = hb.Buffer()
+    buf.add_str(text)
+    buf.guess_segment_properties()
+    if messages is not None:
+        buf.set_message_func(lambda message: messages.append(message) or True)
+    hb.shape(hbfont, buf)
+    return buf
+
+
+# HarfBuzz tells us about every lookup in the feature, including the ones it
+# skips because nothing in the buffer could match.
+def lookups_applied(hbfont, corpus):
+    applied = 0
+    for text in corpus:
+        messages = []
+        shape(hbfont, text, messages)
+        applied += sum(1 for m in messages if m.startswith("start lookup"))
+        applied -= sum(1 for m in messages if m.startswith("skipped lookup"))
+    return applied
+
+
+def measure(name, ttfont, build_time, corpus):
+    buf = io.BytesIO()
+    ttfont.save(buf)
+    hbfont = hb.Font(hb.Face(buf.getvalue()))
+    glyphs = sum(len(text) for text in corpus)
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for text in corpus:
+            shape(hbfont, text)
+    elapsed = time.perf_counter() - start
+    applied = lookups_applied(hbfont, corpus)
+    gsub = len(ttfont.getTableData("GSUB")) if "GSUB" in ttfont else 0
+    print(
+        "%-16s %10.0f %10.2f %12.2f %10i %10i %10.2f"
+        % (
+            name,
+            glyphs * args.repeat / elapsed,
+            applied / glyphs,
+            applied / len(corpus),
+            gsub,
+            len(ttfont["GSUB"].table.LookupList.Lookup) if gsub else 0,
+            build_time,
+        )
+    )
+
+
+corpus = make_corpus(make_ufo())
+print(
+    "%-16s %10s %10s %12s %10s %10s %10s"
+    % (
+        "config",
+        "glyphs/s",
+        "lookups/g",
+        "lookups/text",
+        "GSUB bytes",
+        "lookups",
+        "build (s)",
+    )
+)
+
+start = time.perf_counter()
+original = compileTTF(make_ufo())
+measure("original", original, time.perf_counter() - start, corpus)
+
+for name in args.config or CONFIGS.keys():
+    options = CONFIGS[name]
+    font = make_ufo()
+    start = time.perf_counter()
+    flowify = Flowify(font, **options)
+    ttfont = compileTTF(font)
+    if options.get("output") == "binary":
+        flowify.add_to_binary_font(ttfont)
+    measure(name, ttfont, time.perf_counter() - start, corpus)
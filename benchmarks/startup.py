@@ -0,0 +1,60 @@
+# How long does it take just to load flowify? fontmake imports it on every
+# run which uses the filter, and the command line script pays for it every
+# time it starts. This imports each module in a fresh interpreter, several
+# times over, and reports the best time along with the slowest imports.
+#
+#   python benchmarks/startup.py --repeat 10
+import argparse
+import re
+import subprocess
+import sys
+
+parser = argparse.ArgumentParser(description="Benchmark how long flowify takes to import.")
+parser.add_argument(
+    "--module",
+    action="append",
+    help="Module to import (may be given more than once; default flowify and flowify.main)",
+)
+parser.add_argument(
+    "--repeat", default=5, type=int, help="How many times to import each module"
+)
+parser.add_argument(
+    "--top", default=10, type=int, help="Number of slowest imports to list"
+)
+args = parser.parse_args()
+
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+# -X importtime reports the time taken by every module, in microseconds,
+# both on its own and including everything it imports.
+def import_times(module):
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            own, cumulative, indent, name = match.groups()
+            times[name] = (int(own), int(cumulative), len(indent))
+    return times
+
+
+for module in args.module or ["flowify", "flowify.main"]:
+    runs = [import_times(module) for _ in range(args.repeat)]
+    best = min(runs, key=lambda times: times[module][1])
+    print("%-20s %8.1f ms" % (module, best[module][1] / 1000))
+    # Just the modules it imports directly; each of those includes the cost
+    # of everything it imports in turn. (Nested modules are indented by two
+    # more spaces than the module which imported them.)
+    top_level = [
+        (cumulative, name)
+        for name, (own, cumulative, depth) in best.items()
+        if depth == best[module][2] + 2
+    ]
+    for cumulative, name in sorted(top_level, reverse=True)[: args.top]:
+        print("    %-30s %8.1f ms" % (name, cumulative / 1000))
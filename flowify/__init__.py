@@ -1,16 +1,123 @@
+import copy
+import io
 import logging
+import os
 
-import inflect
-import numpy as np
-from fontFeatures import Chaining, FontFeatures, Routine, Substitution
+from fontTools.feaLib.builder import Builder
+from fontTools.feaLib.error import FeatureLibError
+from fontTools.ttLib import TTFont
+from fontFeatures import (
+    Chaining,
+    FontFeatures,
+    Routine,
+    RoutineReference,
+    Substitution,
+)
 from ufo2ft.filters import BaseFilter
 from ufo2ft.util import _GlyphSet, _LazyFontName
+from ufoLib2 import Font
 from ufoLib2.objects import Glyph
 
+import flowify.binary
+import flowify.cache
 import flowify.drawing
+import flowify.fea
+import flowify.predict
+import flowify.quantize
+import flowify.sizes
+import flowify.stats
+import flowify.subset
 
 logger = logging.getLogger(__name__)
 
+# The parts of the feature made by create_arithmetic_routines
+ARITHMETIC_ROUTINES = [
+    "boundary_routines",
+    "adder1",
+    "adder2",
+    "cleanup_routines",
+]
+ARITHMETIC_CLASSES = [
+    "flow_calc",
+    "flow_calc_carries",
+    "flow_result",
+    "flow_blank",
+    "flow_carries",
+]
+
+# Shared between all the fonts FlowifyFilter sees in one run of fontmake
+family_cache = {}
+
+
+# Copies routines, and the routines their chains call, deeply enough that
+# nothing done to the copy shows up in the original.
+def _copy_routines(thing, memo=None):
+    if memo is None:
+        memo = {}
+    if isinstance(thing, dict):
+        return {k: _copy_routines(v, memo) for k, v in thing.items()}
+    if isinstance(thing, list):
+        return [_copy_routines(x, memo) for x in thing]
+    if isinstance(thing, RoutineReference):
+        thing = thing.routine
+    if not isinstance(thing, Routine):
+        return thing
+    if thing not in memo:
+        routine = copy.copy(thing)
+        routine.usecount = 0
+        routine.parent = None
+        memo[thing] = routine
+        routine.rules = []
+        for rule in thing.rules:
+            rule = copy.copy(rule)
+            for attr in ["input", "precontext", "postcontext", "replacement"]:
+                if getattr(rule, attr, None) is not None:
+                    setattr(rule, attr, list(getattr(rule, attr)))
+            if isinstance(rule, Chaining):
+                rule.lookups = [
+                    _copy_routines(lookups, memo) if lookups else lookups
+                    for lookups in rule.lookups
+                ]
+            routine.rules.append(rule)
+    return memo[thing]
+
+
+# Routines called from chains have to be defined before the routines which
+# call them. fontFeatures can only be relied on to get that right one level
+# deep, so we register them with it ourselves, innermost first.
+def _reference_called_routines(ff, routines):
+    if not isinstance(routines, list):
+        routines = [routines]
+    for routine in routines:
+        if isinstance(routine, RoutineReference):
+            routine = routine.routine
+        for rule in routine.rules:
+            if not isinstance(rule, Chaining):
+                continue
+            for lookups in rule.lookups:
+                for called in lookups or []:
+                    if isinstance(called, RoutineReference):
+                        called = called.routine
+                    if called not in ff.routines:
+                        _reference_called_routines(ff, called)
+                        ff.referenceRoutine(called)
+
+
+# A font to flowify in place of the one given. Flowify adds glyphs,
+# features and names to the font it is given but never changes the glyphs
+# already there, so they go in as they are; everything else is copied.
+def _stand_in_font(font):
+    stand_in = Font(
+        info=copy.deepcopy(font.info),
+        features=font.features.text,
+        groups={k: list(v) for k, v in font.groups.items()},
+        kerning=dict(font.kerning),
+        lib=copy.deepcopy(font.lib),
+    )
+    for glyph in font:
+        stand_in.layers.defaultLayer.insertGlyph(glyph, copy=False)
+    return stand_in
+
 
 class Flowify:
     def __init__(
@@ -22,12 +129,132 @@ class Flowify:
         feature="rlig",
         margin=20,
         debugging=False,
-        max_kern_rules_per_lookup=20,
+        max_kern_rules_per_lookup=None,
+        output="fea",
+        engine="adder",
+        encoding="glyph",
+        kerning="pairs",
+        kern_grid=None,
+        kern_buckets=None,
+        arithmetic="fixed",
+        max_word_length=20,
+        pipeline="separate",
+        subset=None,
+        stats=False,
+        fea_path=None,
+        dry_run=False,
+        family_cache=None,
+        cache_dir=None,
+        cache_size=100 * 1024 * 1024,
     ):
+        if output not in ("fea", "binary"):
+            raise ValueError("output must be 'fea' or 'binary', not %r" % output)
+        if fea_path is not None and output != "fea":
+            raise ValueError("fea_path can only be used when writing feature code")
+        if engine not in ("adder", "fast"):
+            raise ValueError("engine must be 'adder' or 'fast', not %r" % engine)
+        if engine == "fast" and shape != "rectangle":
+            raise ValueError("The fast engine can only make rectangular slugs")
+        # The fast engine never adds up a word's width, so it can't tell
+        # which words are too short for a slug, and a debugging build's
+        # base 10 arithmetic means nothing to it.
+        if engine == "fast" and not no_blank:
+            raise ValueError(
+                "The fast engine can't blank out short words, so it needs no_blank"
+            )
+        if engine == "fast" and debugging:
+            raise ValueError("The fast engine has no arithmetic to debug")
+        if encoding not in ("glyph", "width"):
+            raise ValueError("encoding must be 'glyph' or 'width', not %r" % encoding)
+        if kerning not in ("pairs", "classes"):
+            raise ValueError("kerning must be 'pairs' or 'classes', not %r" % kerning)
+        # Pair kerning has always been split every 20 rules, and packing it
+        # by size can come out bigger when glyph and group kerning are mixed
+        # up, so that stays the default; class-based kerning packs by size.
+        if max_kern_rules_per_lookup is None:
+            max_kern_rules_per_lookup = "auto" if kerning == "classes" else 20
+        if max_kern_rules_per_lookup != "auto" and (
+            not isinstance(max_kern_rules_per_lookup, int)
+            or max_kern_rules_per_lookup < 1
+        ):
+            raise ValueError(
+                "max_kern_rules_per_lookup must be 'auto' or a positive whole "
+                "number, not %r" % max_kern_rules_per_lookup
+            )
+        for name, value in [("kern_grid", kern_grid), ("kern_buckets", kern_buckets)]:
+            if value is not None and (not isinstance(value, int) or value < 1):
+                raise ValueError(
+                    "%s must be a positive whole number, not %r" % (name, value)
+                )
+        if arithmetic not in ("fixed", "auto"):
+            raise ValueError("arithmetic must be 'fixed' or 'auto', not %r" % arithmetic)
+        if pipeline not in ("separate", "fused"):
+            raise ValueError("pipeline must be 'separate' or 'fused', not %r" % pipeline)
+        # A dry run does all the work on a stand-in for the font, and writes
+        # no feature code, so that estimate() can say what a build would
+        # make without changing anything.
+        self.dry_run = dry_run
+        if dry_run:
+            font = _stand_in_font(font)
+            cache_dir = None
         self.font = font
+        self.output = output
+        self.engine = engine
+        self.shape = shape
+        self.no_blank = no_blank
+        self.fea_path = fea_path
+        self.encoding = encoding
+        self.kerning = kerning
+        self.kern_grid = kern_grid
+        self.kern_buckets = kern_buckets
+        self.pipeline = pipeline
         self.max_kern_rules_per_lookup = max_kern_rules_per_lookup
         self.kern_rules = {}
+        self.kern_coverage = {}
+        self.kerning_sides = {}
+        self.kerning_classes = {}
         self.adder_place_cache = {}
+        self.encodings = {}
+        self.place_glyphs = {}
+        self.add_routines = {}
+        self.stats = flowify.stats.Stats(enabled=stats)
+        self.family_cache = family_cache
+
+        # If we've built this font with these options before, use that.
+        self.cache = None
+        if cache_dir is not None:
+            self.cache = flowify.cache.DiskCache(cache_dir, cache_size)
+            self.cache_key = flowify.cache.content_hash(
+                font,
+                dict(
+                    slug_height=slug_height,
+                    no_blank=no_blank,
+                    shape=shape,
+                    feature=feature,
+                    margin=margin,
+                    debugging=debugging,
+                    max_kern_rules_per_lookup=max_kern_rules_per_lookup,
+                    output=output,
+                    engine=engine,
+                    encoding=encoding,
+                    kerning=kerning,
+                    kern_grid=kern_grid,
+                    kern_buckets=kern_buckets,
+                    arithmetic=arithmetic,
+                    max_word_length=max_word_length,
+                    pipeline=pipeline,
+                    subset=subset,
+                ),
+            )
+            with self.stats.stage("cache_lookup"):
+                entry = self.cache.get(self.cache_key)
+            if entry is not None:
+                logger.info("Using cached flow font %s", self.cache_key)
+                self.restore_from_cache(entry)
+                self.add_flow_to_names()
+                return
+            groups_before = {k: list(v) for k, v in font.groups.items()}
+            kerning_before = dict(font.kerning)
 
         if slug_height == "x":
             self.slug_height = font.info.xHeight
@@ -38,24 +265,19 @@ class Flowify:
 
         self.ff = FontFeatures()
 
-        if debugging:
-            # Base 10 is much easier to understand! Use it for a debugging build
-            self.PLACES = 4
-            self.BASE = 10
-        else:
-            # BASE ** PLACES can't go over 32767, so this is as close as we can get
-            # to the actual max advance width
-            self.PLACES = 7
-            self.BASE = 4
-
-        self.encoded_slug_height = self.encode(self.slug_height)
+        self.skip_export_glyphs = frozenset(font.lib.get("public.skipExportGlyphs", []))
+        # With a subset, only the glyphs it needs are flowified.
+        self.subset_glyphs = None
+        if subset is not None:
+            with self.stats.stage("subset"):
+                self.subset_glyphs = flowify.subset.glyph_closure(font, subset)
         self.actual_glyphs = [
             g.name
             for g in font
-            if g.name not in font.lib.get("public.skipExportGlyphs", {})
+            if g.name not in self.skip_export_glyphs
+            and (self.subset_glyphs is None or g.name in self.subset_glyphs)
         ]
 
-        self.setup_needed_glyphs(margin)
         self.relevant_glyphs = []
         for g in self.actual_glyphs:
             if (
@@ -68,31 +290,161 @@ class Flowify:
             if g == ".notdef":
                 continue
             self.relevant_glyphs.append(g)
+        self.relevant_glyph_set = frozenset(self.relevant_glyphs)
 
         if debugging:
-            self.add_debugging_glyphs()
-        self.create_some_routines()
-        self.add_feature(feature, no_blank, shape)
+            # Base 10 is much easier to understand! Use it for a debugging build
+            self.PLACES = 4
+            self.BASE = 10
+        elif arithmetic == "auto":
+            self.choose_arithmetic(max_word_length)
+        else:
+            # BASE ** PLACES can't go over 32767, so this is as close as we can get
+            # to the actual max advance width
+            self.PLACES = 7
+            self.BASE = 4
+        self.encoded_slug_height = self.encode(self.slug_height)
+        self.family_key = (
+            self.BASE,
+            self.PLACES,
+            self.slug_height,
+            margin,
+            shape,
+            no_blank,
+            pipeline,
+        )
 
-        font.info.familyName += " Flow"
-        if font.info.postscriptFontName:
-            font.info.postscriptFontName += " Flow"
-        if font.info.styleMapFamilyName:
-            font.info.styleMapFamilyName += " Flow"
+        with self.stats.stage("setup_glyphs"):
+            if engine == "fast":
+                self.setup_fast_rectangle_glyphs()
+            else:
+                self.setup_needed_glyphs(margin)
+            if debugging:
+                self.add_debugging_glyphs()
+        if engine == "fast":
+            self.add_fast_rectangle_feature(feature)
+        else:
+            with self.stats.stage("create_some_routines"):
+                self.create_some_routines()
+            self.add_feature(feature, no_blank, shape)
+        if self.subset_glyphs is not None:
+            self.drop_unneeded_glyphs()
+        self.count_things()
 
-    def setup_needed_glyphs(self, margin):
+        if self.cache is not None:
+            with self.stats.stage("cache_store"):
+                self.cache.put(
+                    self.cache_key, self.cache_entry(groups_before, kerning_before)
+                )
+        self.add_flow_to_names()
 
-        # Add the left and right ends
-        sc_l = Glyph("slug.left")
-        drawing.draw_semicircle(sc_l, self.slug_height, True, margin=margin)
-        self.font.addGlyph(sc_l)
+    def add_flow_to_names(self):
+        self.font.info.familyName += " Flow"
+        if self.font.info.postscriptFontName:
+            self.font.info.postscriptFontName += " Flow"
+        if self.font.info.styleMapFamilyName:
+            self.font.info.styleMapFamilyName += " Flow"
 
-        sc_r = Glyph("slug.right")
-        drawing.draw_semicircle(sc_r, self.slug_height, False, margin=margin)
-        self.font.addGlyph(sc_r)
+    # Everything outside the subset is dropped from the font, apart from the
+    # glyphs we added
+    def drop_unneeded_glyphs(self):
+        self.kept_glyphs = self.subset_glyphs | set(self.added_glyphs)
+        flowify.subset.drop_glyphs(self.font, self.kept_glyphs)
+
+    # Everything we did to the font, so that next time we can do it again
+    # without working it all out. Binary mode needs the routines themselves
+    # for add_to_binary_font(), and estimate() and slug_layout() need them
+    # along with the arithmetic and the kerning we built, so those are kept
+    # too, even when the feature code is all the font gets.
+    def cache_entry(self, groups_before, kerning_before):
+        return {
+            "relevant_glyphs": self.relevant_glyphs,
+            "actual_glyphs": self.actual_glyphs,
+            "subset_glyphs": self.subset_glyphs,
+            "slug_height": self.slug_height,
+            "base": self.BASE,
+            "places": self.PLACES,
+            "kern_values": getattr(self, "kern_values", None),
+            "kerning_routines": getattr(self, "kerning_routines", []),
+            "glyphs": [
+                flowify.cache.glyph_to_data(self.font[g]) for g in self.added_glyphs
+            ],
+            "groups": {
+                k: list(v)
+                for k, v in self.font.groups.items()
+                if groups_before.get(k) != list(v)
+            },
+            "kerning": {
+                pair: value
+                for pair, value in self.font.kerning.items()
+                if pair not in kerning_before
+            },
+            "fea": self.fea_text() if self.output == "fea" else None,
+            "ff": self.ff,
+        }
 
-        self.added_glyphs = ["slug.left", "slug.right"]
+    def restore_from_cache(self, entry):
+        self.relevant_glyphs = entry["relevant_glyphs"]
+        self.relevant_glyph_set = frozenset(self.relevant_glyphs)
+        self.actual_glyphs = entry["actual_glyphs"]
+        self.slug_height = entry["slug_height"]
+        self.BASE = entry["base"]
+        self.PLACES = entry["places"]
+        if entry["kern_values"] is not None:
+            self.kern_values = entry["kern_values"]
+        self.kerning_routines = entry["kerning_routines"]
+        self.ff = entry["ff"]
+        self.added_glyphs = []
+        for data in entry["glyphs"]:
+            glyph = flowify.cache.glyph_from_data(data)
+            self.font.addGlyph(glyph)
+            self.added_glyphs.append(glyph.name)
+        self.font.groups.update(entry["groups"])
+        self.font.kerning.update(entry["kerning"])
+        self.subset_glyphs = entry["subset_glyphs"]
+        if self.subset_glyphs is not None:
+            self.drop_unneeded_glyphs()
+        if self.output == "fea":
+            self.add_fea_to_font(lambda stream: stream.write(entry["fea"]))
+        self.stats.count("cache_hit", 1)
 
+    # Rather than always paying for seven places, work out how big a number we
+    # actually need to hold: the widest word we expect (max_word_length of the
+    # widest glyph, with the biggest positive kern between each), and also the
+    # slug height and the biggest negative kern, which are stored as
+    # complements. Every place costs a lookup per adder pass, run over a buffer
+    # which has grown by PLACES glyphs for every glyph in the word, and every
+    # digit value costs rules in each place, so we pick the base which
+    # minimises places * (places + base).
+    def choose_arithmetic(self, max_word_length):
+        widest_glyph = max([self.font[g].width for g in self.relevant_glyphs] or [0])
+        kerns = list(self.font.kerning.values()) or [0]
+        needed = max(
+            max_word_length * widest_glyph
+            + (max_word_length - 1) * max(max(kerns), 0),
+            self.slug_height,
+            -min(kerns),
+        )
+        best = None
+        for base in range(2, 17):
+            places = 1
+            while base ** places <= needed:
+                places += 1
+            if base ** places > 32767:
+                continue
+            cost = places * (places + base)
+            if best is None or cost < best[0]:
+                best = (cost, places, base)
+        if best is None:
+            logger.warning(
+                "Words of %i glyphs may be too wide to add up; using 7 places of base 4",
+                max_word_length,
+            )
+            best = (None, 7, 4)
+        _, self.PLACES, self.BASE = best
+        logger.info("Using %i places of base %i", self.PLACES, self.BASE)
+
+    def setup_needed_glyphs(self, margin):
         # We need three different kinds of place glyph:
         #  * _w.XeY holds an intermediate computation: the width of a glyph or partial sum
         #    This needs to be a mark glyph so we can filter on it.
@@ -105,49 +457,100 @@ class Flowify:
         self.calculation_glyphs = []  # All the intermediate computations
         self.carries = []  # All the carries
         self.w_e = []  # All the intermediate computation glyphs for a given place
-        counter = 0
         for exponent in range(self.PLACES):
-            values = []
+            values = ["_w.%ie%i" % (value, exponent) for value in range(self.BASE)]
+            self.w_e.append(values)
+            self.carries.append("_carry.e%i" % exponent)
+            self.calculation_glyphs.extend(values)
+
+        self.added_glyphs = []
+        glyphs = self.shared(
+            "glyphs",
+            lambda: self.draw_needed_glyphs(margin),
+            lambda glyphs: [(drawing.copy_glyph(g), c) for g, c in glyphs],
+        )
+        for g, category in glyphs:
+            self.font.addGlyph(g)
+            self.added_glyphs.append(g.name)
+            if category:
+                self.ff.glyphclasses[g.name] = category
+
+        # When encoding by width, each distinct advance width gets a placeholder
+        # glyph, which is then expanded into its encoded form just once.
+        self.width_placeholders = {}
+        if self.encoding == "width":
+            for g in self.relevant_glyphs:
+                width = int(self.font[g].width)
+                if width in self.width_placeholders:
+                    continue
+                gname = "_width.%s" % str(width).replace("-", "minus")
+                self.font.addGlyph(Glyph(gname))
+                self.ff.glyphclasses[gname] = "mark"
+                self.added_glyphs.append(gname)
+                self.width_placeholders[width] = gname
+
+    # The glyphs which setup_needed_glyphs adds, along with their GDEF classes.
+    def draw_needed_glyphs(self, margin):
+        # Add the left and right ends
+        sc_l = Glyph("slug.left")
+        drawing.draw_semicircle(sc_l, self.slug_height, True, margin=margin)
+
+        sc_r = Glyph("slug.right")
+        drawing.draw_semicircle(sc_r, self.slug_height, False, margin=margin)
+
+        glyphs = [(sc_l, None), (sc_r, None)]
+        for exponent in range(self.PLACES):
             for value in range(self.BASE):
-                counter += 1
-                decimal = value
-                if exponent > 0:
-                    decimal *= self.BASE ** exponent
+                decimal = value * self.BASE ** exponent
                 # Intermediate computation glyph _w.1e1
                 gname = "_w.%ie%i" % (value, exponent)
-                values.append(gname)
-                g = Glyph(gname)
-                self.font.addGlyph(g)
-                self.added_glyphs.append(gname)
-                self.ff.glyphclasses[gname] = "mark"
+                glyphs.append((Glyph(gname), "mark"))
 
                 # Result slug _W.1e1
                 g = Glyph(gname.upper(), width=decimal)
                 drawing.draw_slug(g, decimal, self.slug_height)
-                self.font.addGlyph(g)
-                self.added_glyphs.append(gname.upper())
-                self.ff.glyphclasses[gname.upper()] = "base"
+                glyphs.append((g, "base"))
 
                 # Blank result slug
-                g = Glyph(gname.upper() + ".blank", width=decimal)
-                self.font.addGlyph(g)
-                self.added_glyphs.append(gname.upper() + ".blank")
-                self.ff.glyphclasses[gname.upper() + ".blank"] = "base"
-            self.w_e.append(values)
-            self.font.addGlyph(Glyph("_carry.e%i" % exponent))
-            self.added_glyphs.append("_carry.e%i" % exponent)
-            self.ff.glyphclasses["_carry.e%i" % exponent] = "mark"
-            self.carries.append("_carry.e%i" % exponent)
-            self.calculation_glyphs.extend(values)
+                glyphs.append((Glyph(gname.upper() + ".blank", width=decimal), "base"))
+            glyphs.append((Glyph("_carry.e%i" % exponent), "mark"))
 
         # We also need mark glyphs to mark the start and end of words
         for g in ["_start", "_end"]:
-            self.font.addGlyph(Glyph(g))
-            self.ff.glyphclasses[g] = "mark"
-            self.added_glyphs.append(g)
+            glyphs.append((Glyph(g), "mark"))
+        return glyphs
+
+    # The fast rectangle engine needs no arithmetic at all: every glyph gets a
+    # rectangle of its own advance width, _slug.a for a. We give the
+    # rectangles the same kerning as the glyphs they replace, so that the
+    # font's own GPOS kerning still applies after the substitution.
+    def setup_fast_rectangle_glyphs(self):
+        self.rectangles = {}
+        self.added_glyphs = []
+        for g in self.relevant_glyphs:
+            width = self.font[g].width
+            rectangle = Glyph("_slug." + g, width=width)
+            drawing.draw_slug(rectangle, width, self.slug_height)
+            self.font.addGlyph(rectangle)
+            self.added_glyphs.append(rectangle.name)
+            self.ff.glyphclasses[rectangle.name] = "base"
+            self.rectangles[g] = rectangle.name
+
+        for group, members in list(self.font.groups.items()):
+            if group.startswith("public.kern"):
+                self.font.groups[group] = list(members) + [
+                    self.rectangles[m] for m in members if m in self.rectangles
+                ]
+        for (l, r), value in list(self.font.kerning.items()):
+            pair = (self.rectangles.get(l, l), self.rectangles.get(r, r))
+            if pair != (l, r):
+                self.font.kerning[pair] = value
 
     # If debugging, you get 50 glyphs in the PUA to play with widths directly.
+    # inflect takes seconds to import, so we only load it when it's needed.
     def add_debugging_glyphs(self):
+        import inflect
+
         p = inflect.engine()
         for r in range(50):
             gname = "w." + p.number_to_words(r)
@@ -157,15 +560,45 @@ class Flowify:
     # Turn a glyph into a sequence of glyphs representing its length.
     # i.e. in debugging mode, "a" with width 553 becomes _w.3e0 _w.5e1 _w.5e2 _w.0e3
     # read it backwards: 0553.
+    # The same few widths come up again and again, so each width is only
+    # encoded once, as tuples so that nothing can change the stored copy.
+    # fontFeatures wants lists, so every caller gets fresh ones.
     def encode(self, width):
-        if width < 0:
-            width = self.BASE ** self.PLACES + width
-        glyphs = []
-        for exponent, value in enumerate(
-            reversed(np.base_repr(int(width), base=self.BASE).zfill(self.PLACES))
-        ):
-            glyphs.append(["_w.%se%i" % (value, exponent)])
-        return glyphs
+        if width not in self.encodings:
+            self.encode_all([width])
+        return [list(glyph) for glyph in self.encodings[width]]
+
+    # Encode lots of widths at once, a place at a time: each place of every
+    # width is just an index into that place's glyphs, so there is no string
+    # formatting to do once the place glyphs exist.
+    def encode_all(self, widths):
+        todo = {}
+        for width in widths:
+            if width not in self.encodings and width not in todo:
+                number = self.BASE ** self.PLACES + width if width < 0 else width
+                todo[width] = int(number)
+        if not todo:
+            return
+        places = self.PLACES
+        while self.BASE ** places <= max(todo.values()):
+            places += 1
+        columns = []
+        for place in range(places):
+            if place not in self.place_glyphs:
+                self.place_glyphs[place] = [
+                    ("_w.%ie%i" % (value, place),) for value in range(self.BASE)
+                ]
+            glyphs = self.place_glyphs[place]
+            unit = self.BASE ** place
+            columns.append([glyphs[n // unit % self.BASE] for n in todo.values()])
+        for (width, number), encoded in zip(todo.items(), zip(*columns)):
+            # Widths too big to hold only get as many places as they need
+            if places > self.PLACES:
+                needed = self.PLACES
+                while self.BASE ** needed <= number:
+                    needed += 1
+                encoded = encoded[:needed]
+            self.encodings[width] = encoded
 
     # Kerning will be handed by inserting another glyph-sequence into the sum.
     # A positive kern is easy: kern 10 units just means _w.0e0 _w.1e1 _w.0e2 _w.0e3
@@ -175,25 +608,28 @@ class Flowify:
     # We will build the coverage / substitution for each of the "kernXX" lookups
     # dynamically; when we add "sub [a b]' lookup kernminus10 y" to the kern table,
     # we grab our cached "kernminus10" and then ensure that it includes coverage for
-    # glyphs "a" and "b".
+    # glyphs "a" and "b". We keep a set of the glyphs each one already covers, so
+    # that only the new ones need adding.
     def kern_rule_for(self, l, value):
         if value not in self.kern_rules:
             self.kern_rules[value] = Routine(
                 name="kern_%s" % (str(value).replace("-", "minus")),
-                rules=[Substitution([set()], replacement=[set()] + self.encode(value))],
+                rules=[Substitution([[]], replacement=[[]] + self.encode(value))],
             )
-        self.kern_rules[value].rules[0].replacement[0] = list(
-            set(self.kern_rules[value].rules[0].input[0]) | set(l)
-        )
-        self.kern_rules[value].rules[0].input[0] = list(
-            set(self.kern_rules[value].rules[0].input[0]) | set(l)
-        )
+            self.kern_coverage[value] = set()
+        rule = self.kern_rules[value].rules[0]
+        covered = self.kern_coverage[value]
+        for glyph in l:
+            if glyph not in covered:
+                covered.add(glyph)
+                rule.input[0].append(glyph)
+                rule.replacement[0].append(glyph)
 
         return self.kern_rules[value]
 
     # Now the actual lookups!
 
-    def create_some_routines(self):
+    def create_delete_marks(self):
         # Attached mark glyphs get in the way, so we remove them early.
         marks = [
             g
@@ -202,80 +638,101 @@ class Flowify:
             or self.font[g].width == 0
         ]
         self.delete_marks = Routine(
-            name="delete_marks", rules=[Substitution([marks], [])]
+            name="delete_marks",
+            rules=[Substitution([self.glyph_class("flow_marks", marks)], [])],
+        )
+
+    # Long glyph lists are defined once as named classes and referred to by
+    # name, rather than being written out again in every rule that uses them.
+    def glyph_class(self, name, glyphs):
+        self.ff.namedClasses[name] = list(glyphs)
+        return ["@" + name]
+
+    # The routines which depend on the glyphs in the font
+    def create_some_routines(self):
+        self.create_delete_marks()
+        self.glyph_class("flow_relevant", self.relevant_glyphs)
+
+        # These are the substitutions which turn each glyph into the encoded
+        # form of its advance width
+        self.subrules = Routine(name="encode")
+        if self.encoding == "width":
+            # Glyphs of the same width all go to the same placeholder first, so
+            # we only need one encoding per distinct width.
+            by_width = {}
+            for g in self.relevant_glyphs:
+                by_width.setdefault(int(self.font[g].width), []).append(g)
+            self.encode_widths = Routine(name="encode_widths")
+            for width, glyphs in by_width.items():
+                placeholder = self.width_placeholders[width]
+                if len(glyphs) > 1:
+                    glyphs = self.glyph_class(placeholder[1:].replace(".", "_"), glyphs)
+                self.encode_widths.rules.append(
+                    Substitution([glyphs], [[placeholder]])
+                )
+                self.subrules.rules.append(
+                    Substitution([[placeholder]], self.encode(width))
+                )
+            self.encode_routines = [self.encode_widths, self.subrules]
+        else:
+            widths = [self.font[g].width for g in self.relevant_glyphs]
+            self.encode_all(widths)
+            for g, width in zip(self.relevant_glyphs, widths):
+                self.subrules.rules.append(Substitution([[g]], self.encode(width)))
+            self.encode_routines = [self.subrules]
+
+    # Everything else only depends on the arithmetic and the slug, so it is the
+    # same for every master in a family.
+    def create_arithmetic_routines(self, no_blank, shape):
+        relevant = ["@flow_relevant"]
+        self.calculation_class = self.glyph_class("flow_calc", self.calculation_glyphs)
+        self.calculation_and_carries_class = self.glyph_class(
+            "flow_calc_carries", self.calculation_glyphs + self.carries
         )
 
-        # Routines to add marker glyphs at start and end
+        # Routines to add marker glyphs at start and end. When adding the end
+        # marker glyph, we will also add a set of zeros to hold the final
+        # computation. Adding a zero at the end means the last digit's carries
+        # are processed.
+        self.do_add_start = Routine(
+            name="do_add_start",
+            rules=[Substitution([relevant], [["_start"], relevant])],
+        )
+        self.do_add_end = Routine(
+            name="do_add_end",
+            rules=[
+                Substitution(
+                    [relevant],
+                    [relevant] + self.encode(0) + [["_end"]],
+                    # [relevant_glyphs] + [["_end"]],
+                )
+            ],
+        )
         self.add_start = Routine(
             name="add_start",
             flags=0x8,
             rules=[
                 Chaining(
-                    [self.relevant_glyphs],
-                    precontext=[self.relevant_glyphs],
+                    [relevant],
+                    precontext=[relevant],
                     lookups=[[]],
                 ),
-                Chaining(
-                    [self.relevant_glyphs],
-                    lookups=[
-                        [
-                            Routine(
-                                name="do_add_start",
-                                rules=[
-                                    Substitution(
-                                        [self.relevant_glyphs],
-                                        [["_start"], self.relevant_glyphs],
-                                    )
-                                ],
-                            )
-                        ]
-                    ],
-                ),
+                Chaining([relevant], lookups=[[self.do_add_start]]),
             ],
         )
-
-        # When adding the end marker glyph, we will also add a set of zeros to hold
-        # the final computation. Adding a zero at the end means the last digit's
-        # carries are processed.
         self.add_end = Routine(
             name="add_end",
             flags=0x8,
             rules=[
                 Chaining(
-                    [self.relevant_glyphs],
-                    postcontext=[self.relevant_glyphs],
+                    [relevant],
+                    postcontext=[relevant],
                     lookups=[[]],
                 ),
-                Chaining(
-                    [self.relevant_glyphs],
-                    lookups=[
-                        [
-                            Routine(
-                                name="do_add_end",
-                                rules=[
-                                    Substitution(
-                                        [self.relevant_glyphs],
-                                        [self.relevant_glyphs]
-                                        + self.encode(0)
-                                        + [["_end"]],
-                                        # [relevant_glyphs] + [["_end"]],
-                                    )
-                                ],
-                            )
-                        ]
-                    ],
-                ),
+                Chaining([relevant], lookups=[[self.do_add_end]]),
             ],
         )
 
-        # These are the substitutions which turn each glyph into the encoded
-        # form of its advance width
-        self.subrules = Routine(name="encode")
-        for g in self.relevant_glyphs:
-            self.subrules.rules.append(
-                Substitution([[g]], self.encode(self.font[g].width))
-            )
-
         # Replace the intermediate glyphs with upper-case versions to form the slug.
         # We will contextually apply this only to the rightmost number in the sequence
         # (i.e. the overall total).
@@ -283,8 +740,12 @@ class Flowify:
             name="do_record_result",
             rules=[
                 Substitution(
-                    [self.calculation_glyphs],
-                    [[x.upper() for x in self.calculation_glyphs]],
+                    [self.calculation_class],
+                    [
+                        self.glyph_class(
+                            "flow_result", [x.upper() for x in self.calculation_glyphs]
+                        )
+                    ],
                 )
             ],
         )
@@ -293,7 +754,7 @@ class Flowify:
         # after we've done the sum
         self.do_delete = Routine(
             name="delete",
-            rules=[Substitution([self.calculation_glyphs + self.carries], [])],
+            rules=[Substitution([self.calculation_and_carries_class], [])],
         )
 
         # Interim calculations get deleted but final calculations get uppercased
@@ -309,25 +770,23 @@ class Flowify:
                     lookups=[[self.do_record_result]] * self.PLACES,
                 ),
                 Chaining(
-                    [self.calculation_glyphs + self.carries], lookups=[[self.do_delete]]
+                    [self.calculation_and_carries_class], lookups=[[self.do_delete]]
                 ),
             ],
         )
 
-        # A routine to insert the starting semicircle after the start
-        # marker glyph
-        self.insert_start_slug = Routine(
-            name="insert_start_slug",
-            rules=[Substitution([["_start"]], [["slug.left"], ["_start"]])],
-        )
-
         # A routine to blank out words whose advance width is < slug_height
         self.do_blank = Routine(
             name="do_blank",
             rules=[
                 Substitution(
-                    [self.calculation_glyphs],
-                    [[x.upper() + ".blank" for x in self.calculation_glyphs]],
+                    [self.calculation_class],
+                    [
+                        self.glyph_class(
+                            "flow_blank",
+                            [x.upper() + ".blank" for x in self.calculation_glyphs],
+                        )
+                    ],
                 )
             ],
         )
@@ -335,12 +794,108 @@ class Flowify:
         # I just like to be tidy.
         self.delete_carries = Routine(
             name="delete_carries",
-            rules=[Substitution([self.carries], [])],
+            rules=[Substitution([self.glyph_class("flow_carries", self.carries)], [])],
         )
         self.delete_rubbish = Routine(
             name="delete_rubbish",
             rules=[Substitution([["_start", "_end"]], [])],
         )
+        self.boundary_routines = [self.add_start, self.add_end]
+        self.cleanup_routines = [
+            self.delete_carries,
+            self.record_result,
+            self.delete_rubbish,
+        ]
+        if self.pipeline == "fused":
+            self.fuse_boundaries_and_cleanup()
+
+        self.adder1 = self.make_an_adder(1)
+        if shape == "pill":
+            compares, first_place = self.add_slugs(no_blank)
+            self.adder2 = compares + self.make_an_adder(2, first_place)
+        else:
+            self.adder2 = []
+
+    # Every lookup is another pass over the whole buffer, so the fused
+    # pipeline does the same work in fewer of them. The start and end markers
+    # go in with a single lookup: each glyph of a word is either in the
+    # middle, at the end, at the start or on its own, and the markers added
+    # before a glyph are marks, so they don't get in the way of the context
+    # for the glyph after it. At the end, record_result is told to skip over
+    # the carries, so they can be deleted afterwards along with the markers.
+    #
+    # delete_marks has to stay a lookup of its own: the marker lookup skips
+    # over mark glyphs, so it can't delete them.
+    def fuse_boundaries_and_cleanup(self):
+        relevant = ["@flow_relevant"]
+        do_add_both = Routine(
+            name="do_add_both",
+            rules=[
+                Substitution(
+                    [relevant],
+                    [["_start"], relevant] + self.encode(0) + [["_end"]],
+                )
+            ],
+        )
+        add_boundaries = Routine(
+            name="add_boundaries",
+            flags=0x8,
+            rules=[
+                Chaining(
+                    [relevant],
+                    precontext=[relevant],
+                    postcontext=[relevant],
+                    lookups=[[]],
+                ),
+                Chaining(
+                    [relevant], precontext=[relevant], lookups=[[self.do_add_end]]
+                ),
+                Chaining(
+                    [relevant], postcontext=[relevant], lookups=[[self.do_add_start]]
+                ),
+                Chaining([relevant], lookups=[[do_add_both]]),
+            ],
+        )
+        tidy_up = Routine(
+            name="tidy_up",
+            rules=[
+                Substitution([["@flow_carries"]], []),
+                Substitution([["_start", "_end"]], []),
+            ],
+        )
+        self.record_result.flags = 0x10
+        self.boundary_routines = [add_boundaries]
+        self.cleanup_routines = [self.record_result, tidy_up]
+
+    def setup_arithmetic_routines(self, no_blank, shape):
+        def make():
+            self.create_arithmetic_routines(no_blank, shape)
+            shared = {name: getattr(self, name) for name in ARITHMETIC_ROUTINES}
+            shared["classes"] = {
+                name: self.ff.namedClasses[name] for name in ARITHMETIC_CLASSES
+            }
+            return shared
+
+        shared = self.shared("routines", make, _copy_routines)
+        self.ff.namedClasses.update(shared.pop("classes"))
+        for name, value in shared.items():
+            setattr(self, name, value)
+        for name in ARITHMETIC_ROUTINES:
+            _reference_called_routines(self.ff, getattr(self, name))
+
+    # When we've been given a family cache, things which are the same for every
+    # master are only made once. The cache keeps its own copy, and each font
+    # gets a copy of that, because writing out the feature code changes the
+    # routines it writes.
+    def shared(self, name, make, copy):
+        if self.family_cache is None:
+            return make()
+        family = self.family_cache.setdefault(self.family_key, {})
+        if name in family:
+            return copy(family[name])
+        made = make()
+        family[name] = copy(made)
+        return made
 
     # Trickier lookups require their own methods! Let's start with kerning.
     # The aim of the game is to convert each kerning rule into a substitution rule.
@@ -348,53 +903,179 @@ class Flowify:
     # as a class-based pair positioning lookup, so we have to split the rule every
     # so often to stop it overflowing.
     def make_kerning_routines(self):
+        self.quantize_kerning()
+        if self.kerning == "classes":
+            return self.make_class_kerning_routines()
+        pairs = []
+        for (l, r), value in self.font.kerning.items():
+            l = self.kerning_side(l)
+            r = self.kerning_side(r)
+            if l and r:
+                pairs.append((l, r, self.kern_values[value]))
+        return self.pack_kerning_rules("slug_kerning", pairs)
+
+    # Each distinct kern value costs a lookup, so with kern_grid or
+    # kern_buckets we make do with fewer of them. The error this brings in is
+    # how far each pair ends up from its real kerning; a word is out by the
+    # sum of the errors of the pairs in it. kern_errors keeps the error of
+    # every pair that moved, so you can see which words will suffer.
+    def quantize_kerning(self):
+        values = list(self.font.kerning.values())
+        self.kern_values = quantize.kern_value_map(
+            values, self.kern_grid, self.kern_buckets
+        )
+        self.kern_errors = {}
+        if not values or (self.kern_grid is None and self.kern_buckets is None):
+            return
+        errors = [abs(self.kern_values[v] - v) for v in values]
+        for (l, r), value in self.font.kerning.items():
+            error = abs(self.kern_values[value] - value)
+            if error:
+                self.kern_errors[(l, r)] = error
+                logger.debug(
+                    "Kerning %s %s quantized from %s to %s",
+                    l,
+                    r,
+                    value,
+                    self.kern_values[value],
+                )
+        logger.info(
+            "Quantized %i kern values into %i; each pair is out by at most %s "
+            "units (%.1f on average, %s in total)",
+            len(self.kern_values),
+            len(set(self.kern_values.values())),
+            max(errors),
+            sum(errors) / len(errors),
+            sum(errors),
+        )
+        self.stats.count("kern_values", len(self.kern_values))
+        self.stats.count("quantized_kern_values", len(set(self.kern_values.values())))
+        self.stats.count("kern_error_max", max(errors))
+        self.stats.count("kern_error_mean", round(sum(errors) / len(errors), 2))
+        self.stats.count("kern_error_total", sum(errors))
+        self.stats.count(
+            "kern_errors",
+            {"%s %s" % pair: error for pair, error in self.kern_errors.items()},
+        )
+
+    # Split the kerning rules into as many lookups as we need. With a number
+    # for max_kern_rules_per_lookup, that is how many rules go in each lookup;
+    # in "auto" mode we keep an estimate of how big each lookup will be when
+    # compiled, and start a new one whenever that makes for a smaller font,
+    # and always before the lookup goes over the 64K limit.
+    def pack_kerning_rules(self, name, pairs):
         kerning_routines = []
         kerning = None
-        for (l, r), value in self.font.kerning.items():
-            if not kerning:
-                kerning = Routine(name="slug_kerning_%i" % len(kerning_routines))
-            l = self.font.groups.get(l, [l])
-            r = self.font.groups.get(r, [r])
-            l = [
-                x
-                for x in l
-                if x not in self.font.lib.get("public.skipExportGlyphs", {})
-                and x in self.relevant_glyphs
-            ]
-            r = [
+        for l, r, value in pairs:
+            if kerning is None or self.kerning_lookup_is_full(
+                kerning, size, l, r, value
+            ):
+                kerning = Routine(name="%s_%i" % (name, len(kerning_routines)))
+                kerning_routines.append(kerning)
+                size = sizes.ChainingLookupSize()
+                sides = []
+            rule = Chaining(
+                [self.kerning_class(l)],
+                postcontext=[self.kerning_class(r)],
+                lookups=[[self.kern_rule_for(l, value)], []],
+            )
+            at = self.kerning_rule_position(sides, l, r, value)
+            kerning.rules.insert(at, rule)
+            sides.insert(at, (set(l), set(r), value))
+            size.add(l, r, value)
+        return kerning_routines
+
+    # feaLib merges a rule into the one before it when only their inputs
+    # differ, and then the lookup can't be compiled as a format 1 or 2
+    # subtable any more. So if the last rule kerns the same right side by
+    # the same amount, we move the new one back until it sits between two
+    # rules which don't, as long as it doesn't jump over a rule it overlaps
+    # with (and would kern differently). If there's nowhere to put it, it
+    # goes on the end and gets merged.
+    def kerning_rule_position(self, sides, l, r, value):
+        left, right = set(l), set(r)
+
+        def same(at):
+            return 0 <= at < len(sides) and sides[at][1:] == (right, value)
+
+        at = len(sides)
+        if not same(at - 1):
+            return at
+        while at > 0:
+            other_left, other_right, other_value = sides[at - 1]
+            if other_value != value and left & other_left and right & other_right:
+                break
+            at -= 1
+            if not same(at - 1) and not same(at):
+                return at
+        return len(sides)
+
+    def kerning_lookup_is_full(self, routine, size, left, right, value):
+        if self.max_kern_rules_per_lookup == "auto":
+            return size.would_overflow(left, right, value)
+        return len(routine.rules) > self.max_kern_rules_per_lookup
+
+    # The glyphs on one side of a kerning pair which we actually need to kern.
+    # Groups turn up in lots of pairs, so we only work this out once for each.
+    # (Relevant glyphs never include the ones which aren't exported.)
+    def kerning_side(self, name):
+        if name not in self.kerning_sides:
+            self.kerning_sides[name] = [
                 x
-                for x in r
-                if x not in self.font.lib.get("public.skipExportGlyphs", {})
-                and x in self.relevant_glyphs
+                for x in self.font.groups.get(name, [name])
+                if x in self.relevant_glyph_set
             ]
-            if l and r:
-                kerning.rules.append(
-                    Chaining(
-                        [l],
-                        postcontext=[r],
-                        lookups=[[self.kern_rule_for(l, value)], []],
-                    )
+        return self.kerning_sides[name]
+
+    # Class-based kerning puts all the pairs of each kind into a single lookup,
+    # in order of precedence: glyph-glyph, glyph-group, group-glyph, then
+    # group-group. Once a pair has been kerned, the encoded kern value sits
+    # between the two glyphs, so a later lookup can't kern it again. Within each
+    # lookup the classes on either side don't overlap, so the chains can be
+    # compiled into a class-based (format 2) subtable instead of one subtable
+    # per pair.
+    def make_class_kerning_routines(self):
+        kinds = {}
+        for (l, r), value in self.font.kerning.items():
+            kind = (l in self.font.groups, r in self.font.groups)
+            left = self.kerning_side(l)
+            right = self.kerning_side(r)
+            if left and right:
+                value = self.kern_values[value]
+                kinds.setdefault(kind, []).append((left, right, value))
+        kerning_routines = []
+        for kind in [(False, False), (False, True), (True, False), (True, True)]:
+            if kind in kinds:
+                name = "slug_kerning_%s_%s" % tuple(
+                    "group" if x else "glyph" for x in kind
+                )
+                kerning_routines.extend(
+                    self.pack_kerning_rules(name, kinds[kind])
                 )
-            if len(kerning.rules) > self.max_kern_rules_per_lookup:
-                kerning_routines.append(kerning)
-                kerning = None
-        if kerning:
-            kerning_routines.append(kerning)
         return kerning_routines
 
+    # Kerning groups turn up on both sides of lots of pairs, so each distinct
+    # list of glyphs gets one shared class.
+    def kerning_class(self, glyphs):
+        if len(glyphs) == 1:
+            return glyphs
+        key = tuple(sorted(glyphs))
+        if key not in self.kerning_classes:
+            self.kerning_classes[key] = self.glyph_class(
+                "flow_kern%i" % len(self.kerning_classes), key
+            )
+        return self.kerning_classes[key]
+
     # Now we build the adder routine. Probably best to look at the output
     # feature code to understand what this is doing.
-    def _make_an_adder_for_place(self, exponent):
-        value = self.BASE ** exponent
-
-        def make_add_routine(add):
-            name = "add_%i" % (add * value)
-            if add == self.BASE:
-                name += "_c"
-            try:
-                return self.ff.referenceRoutine(self.ff.routineNamed(name))
-            except ValueError:
-                pass
+    # The add_N routines and the adder_place_N routines only depend on the
+    # place, so we build each of them once and share them between both runs
+    # of the adder.
+    def make_add_routine(self, add, exponent):
+        name = "add_%i" % (add * self.BASE ** exponent)
+        if add == self.BASE:
+            name += "_c"
+        if name not in self.add_routines:
             rules = []
             for before in range(0, self.BASE):
                 after = before + add
@@ -418,73 +1099,68 @@ class Flowify:
                         [["_w.%ie%i" % (after, exponent)]],
                     )
                 )
-            return self.ff.referenceRoutine(Routine(name=name, rules=rules))
+            self.add_routines[name] = Routine(name=name, rules=rules)
+        return self.ff.referenceRoutine(self.add_routines[name])
 
-        routines = [make_add_routine(i) for i in range(0, self.BASE + 1)]
+    def adder_place(self, exponent):
+        if exponent in self.adder_place_cache:
+            return self.adder_place_cache[exponent]
+        routines = [self.make_add_routine(i, exponent) for i in range(0, self.BASE + 1)]
         # We don't actually need an "add zero" but it makes the list indices match up
 
         if exponent == 0:
-            if 0 not in self.adder_place_cache:
-                self.adder_place_cache[0] = Routine(
-                    name="adder_place_%i" % exponent,
-                    flags=0x10,
-                    markFilteringSet=["_start", "_end"] + self.w_e[0],
-                )
-                for i in range(1, self.BASE):
-                    self.adder_place_cache[0].rules.append(
-                        Chaining(
-                            [["_w.%ie0" % i], self.w_e[0]],
-                            lookups=([[], [routines[i]]]),
-                        )
-                    )
-            return Routine(
-                name="adder0",
-                rules=[
-                    Chaining([self.w_e[0]], lookups=[[self.adder_place_cache[0]]]),
-                ],
+            place = Routine(
+                name="adder_place_%i" % exponent,
+                flags=0x10,
+                markFilteringSet=["_start", "_end"] + self.w_e[0],
             )
         else:
-            if exponent not in self.adder_place_cache:
-                self.adder_place_cache[exponent] = Routine(
-                    flags=0x10,
-                    name="adder_place_%i" % exponent,
-                    markFilteringSet=["_start", "_end", "_carry.e%i" % exponent]
-                    + self.w_e[exponent],
-                )
-                # Add carry rules first
-                for i in range(0, self.BASE):
-                    self.adder_place_cache[exponent].rules.append(
-                        Chaining(
-                            [
-                                ["_w.%ie%i" % (i, exponent)],
-                                ["_carry.e%i" % exponent],
-                                self.w_e[exponent],
-                            ],
-                            lookups=[[], [], [routines[i + 1]]],
-                        ),
-                    )
-                for i in range(1, self.BASE):
-                    self.adder_place_cache[exponent].rules.append(
-                        Chaining(
-                            [["_w.%ie%i" % (i, exponent)], self.w_e[exponent]],
-                            lookups=[[], [routines[i]]],
-                        )
-                    )
-            return Routine(
-                name="adder%i" % exponent,
-                markFilteringSet=self.calculation_glyphs,
-                rules=[
+            place = Routine(
+                flags=0x10,
+                name="adder_place_%i" % exponent,
+                markFilteringSet=["_start", "_end", "_carry.e%i" % exponent]
+                + self.w_e[exponent],
+            )
+            # Add carry rules first
+            for i in range(0, self.BASE):
+                place.rules.append(
                     Chaining(
-                        [self.w_e[exponent]],
-                        lookups=[[self.adder_place_cache[exponent]]],
+                        [
+                            ["_w.%ie%i" % (i, exponent)],
+                            ["_carry.e%i" % exponent],
+                            self.w_e[exponent],
+                        ],
+                        lookups=[[], [], [routines[i + 1]]],
                     ),
-                ],
+                )
+        for i in range(1, self.BASE):
+            place.rules.append(
+                Chaining(
+                    [["_w.%ie%i" % (i, exponent)], self.w_e[exponent]],
+                    lookups=[[], [routines[i]]],
+                )
             )
+        self.adder_place_cache[exponent] = place
+        return place
 
-    def make_an_adder(self, generation):
-        place_adders = [self._make_an_adder_for_place(i) for i in range(0, self.PLACES)]
-        for p in place_adders:
-            p.name = p.name + "_%i" % generation
+    # A feature only runs each lookup once, so every run of the adder needs its
+    # own top-level lookups, even though they call the same routines inside.
+    # Places below first_place are left alone.
+    def make_an_adder(self, generation, first_place=0):
+        place_adders = []
+        for exponent in range(first_place, self.PLACES):
+            place_adders.append(
+                Routine(
+                    name="adder%i_%i" % (exponent, generation),
+                    markFilteringSet=self.calculation_glyphs if exponent else None,
+                    rules=[
+                        Chaining(
+                            [self.w_e[exponent]],
+                            lookups=[[self.adder_place(exponent)]],
+                        ),
+                    ],
+                )
+            )
         return place_adders
 
     # Is the length > slug_height?
@@ -502,7 +1178,7 @@ class Flowify:
     def test_if_length_is_more_than_slug_height(self):
         # fill() turns "3" into "3456789" in the example above
         def fill(glyph):
-            value, exponent = int(glyph[-3]), int(glyph[-1])
+            value, exponent = [int(x) for x in glyph[3:].split("e")]
             if value == self.BASE - 1:
                 return []
             return self.w_e[exponent][value + 1 :]
@@ -535,7 +1211,7 @@ class Flowify:
                     lookups=[[]] * self.PLACES,  # This is the last one
                 ),
                 Chaining(
-                    [self.calculation_glyphs + self.carries], lookups=[[self.do_delete]]
+                    [self.calculation_and_carries_class], lookups=[[self.do_delete]]
                 ),
             ],
         )
@@ -543,13 +1219,22 @@ class Flowify:
         # After we've inserted the two semicircles, our total slug is now bigger than it
         # should be. So we need to take away the length of the semicircle. To do this, we
         # insert a negative kern the size of the slug height, and we'll have another round
-        # with the adder to find the final size.
-        insert_negative_and_end_slug = Routine(
-            name="insert_negative_and_end_slug",
+        # with the adder to find the final size. The negative number goes in front of the
+        # total, so that the total stays the last number in the word; that way we only
+        # need to go round the adder again for the places where the negative number has
+        # something other than a zero.
+        negative = self.encode(-self.slug_height)
+        first_place = self.first_nonzero_place(negative)
+        insert_end_slug = Routine(
+            name="insert_end_slug",
+            rules=[Substitution([["_end"]], [["_end"], ["slug.right"]])],
+        )
+        insert_start_slug_and_negative = Routine(
+            name="insert_start_slug_and_negative",
             rules=[
                 Substitution(
-                    [["_end"]],
-                    self.encode(-self.slug_height) + [["_end"], ["slug.right"]],
+                    [["_start"]],
+                    [["slug.left"], ["_start"]] + negative[first_place:],
                 )
             ],
         )
@@ -569,7 +1254,7 @@ class Flowify:
             compare1.rules.append(
                 Chaining(
                     [["_start"]] + p + [["_end"]],
-                    lookups=[[]] * (1 + self.PLACES) + [[insert_negative_and_end_slug]],
+                    lookups=[[]] * (1 + self.PLACES) + [[insert_end_slug]],
                 )
             )
         compare2 = Routine(
@@ -580,7 +1265,7 @@ class Flowify:
             compare2.rules.append(
                 Chaining(
                     [["_start"]] + p,
-                    lookups=[[self.insert_start_slug]] + [[]] * self.PLACES,
+                    lookups=[[insert_start_slug_and_negative]] + [[]] * self.PLACES,
                 )
             )
         # Here we blank out things which are not bigger than the slug height.
@@ -591,26 +1276,248 @@ class Flowify:
                     lookups=([[]] + [[self.do_blank]] * self.PLACES + [[]]),
                 ),
             )
-        return [tidy_result, compare1, compare2]
+        return [tidy_result, compare1, compare2], first_place
+
+    def first_nonzero_place(self, encoded):
+        for place, digit in enumerate(encoded):
+            if digit != ["_w.0e%i" % place]:
+                return place
+        return self.PLACES
 
     def add_feature(self, feature, no_blank=False, shape="pill"):
-        if shape == "pill":
-            stage2 = self.add_slugs(no_blank) + self.make_an_adder(2)
-        else:
-            stage2 = []
+        with self.stats.stage("make_kerning_routines"):
+            self.kerning_routines = self.make_kerning_routines()
+        with self.stats.stage("make_an_adder"):
+            self.setup_arithmetic_routines(no_blank, shape)
         # Put it all together
         self.ff.addFeature(
             feature,
-            [self.add_start, self.add_end, self.delete_marks]
-            + self.make_kerning_routines()
-            + [self.subrules]
-            + self.make_an_adder(1)
-            + stage2
-            + [self.delete_carries, self.record_result, self.delete_rubbish],
+            self.boundary_routines
+            + [self.delete_marks]
+            + self.kerning_routines
+            + self.encode_routines
+            + self.adder1
+            + self.adder2
+            + self.cleanup_routines,
         )
 
-        # Add our features to the end of the feature file
-        self.font.features.text += self.ff.asFea()
+        self.write_features()
+
+    # The whole of the fast rectangle engine is a single substitution.
+    def add_fast_rectangle_feature(self, feature):
+        self.create_delete_marks()
+        self.fast_rectangles = Routine(
+            name="fast_rectangles",
+            rules=[
+                Substitution(
+                    [self.glyph_class("flow_relevant", self.relevant_glyphs)],
+                    [
+                        self.glyph_class(
+                            "flow_rectangles",
+                            [self.rectangles[g] for g in self.relevant_glyphs],
+                        )
+                    ],
+                )
+            ],
+        )
+        self.ff.addFeature(feature, [self.delete_marks, self.fast_rectangles])
+        self.write_features()
+
+    def write_features(self):
+        # Add our features to the end of the feature file. In binary mode we
+        # leave the feature file alone, and add_to_binary_font() puts the
+        # lookups into the compiled font instead; in a dry run we do neither.
+        if self.output == "fea" and not self.dry_run:
+            with self.stats.stage("asFea"):
+                self.add_fea_to_font(lambda stream: fea.write_fea(self.ff, stream))
+            if self.stats.enabled:
+                with self.stats.stage("fealib_build"):
+                    self.build_fea()
+
+    # Compiling the feature code is often the slowest part of making a flow
+    # font, and it happens later in fontmake where we can't time it. So with
+    # statistics on, we compile ours on its own into an otherwise empty font.
+    def build_fea(self):
+        ttfont = TTFont()
+        ttfont.setGlyphOrder([g.name for g in self.font])
+        try:
+            Builder(ttfont, io.StringIO(self.fea_text())).build()
+        except FeatureLibError as e:
+            logger.warning("Couldn't compile the flow feature code: %s", e)
+
+    # With fea_path, the feature code is streamed straight into that file,
+    # and the font's own feature code include()s it. Otherwise it goes on the
+    # end of the font's feature code.
+    def add_fea_to_font(self, write):
+        if self.fea_path is None:
+            stream = io.StringIO()
+            write(stream)
+            self.fea = stream.getvalue()
+            self.font.features.text += self.fea
+        else:
+            with open(self.fea_path, "w", encoding="utf-8") as f:
+                write(f)
+            self.fea = None
+            self.font.features.text += "\ninclude(%s);\n" % self.fea_include()
+
+    # include() paths are relative to the directory the UFO is in, or to the
+    # current directory for a font which hasn't been saved anywhere.
+    def fea_include(self):
+        if self.font.path is not None:
+            directory = os.path.dirname(os.path.abspath(self.font.path))
+        else:
+            directory = os.getcwd()
+        return os.path.relpath(os.path.abspath(self.fea_path), directory)
+
+    def fea_text(self):
+        if self.fea_path is None:
+            return self.fea
+        with open(self.fea_path, encoding="utf-8") as f:
+            return f.read()
+
+    # Binary mode: once the font has been compiled, merge our lookups and
+    # GDEF classes directly into its GSUB and GDEF tables.
+    def add_to_binary_font(self, ttfont):
+        with self.stats.stage("add_to_binary_font"):
+            binary.add_features_to_font(self.ff, ttfont)
+        if self.subset_glyphs is not None:
+            with self.stats.stage("subset_binary"):
+                flowify.subset.subset_binary(ttfont, keep=self.kept_glyphs)
+
+    # What the flow font does to text, without having to shape it
+    def slug_layout(self):
+        return predict.SlugLayout.from_flowify(self)
+
+    # How big is what we've built? Only worked out when statistics are on,
+    # because counting the lookups means walking all the routines again.
+    def count_things(self):
+        if not self.stats.enabled:
+            return
+        compiler = binary.LookupCompiler(self.ff, None)
+        for routines in self.ff.features.values():
+            compiler.collect(routines)
+        self.stats.count("relevant_glyphs", len(self.relevant_glyphs))
+        self.stats.count("added_glyphs", len(self.added_glyphs))
+        self.stats.count(
+            "kern_rules", sum(len(r.rules) for r in getattr(self, "kerning_routines", []))
+        )
+        self.stats.count("kern_value_routines", len(self.kern_rules))
+        self.stats.count("lookups", len(compiler.routines))
+        self.stats.count("rules", sum(len(r.rules) for r in compiler.routines))
+        if self.output == "fea":
+            if self.fea_path is None:
+                self.stats.count("fea_bytes", len(self.fea.encode("utf-8")))
+            else:
+                self.stats.count("fea_bytes", os.path.getsize(self.fea_path))
+
+    # How big will our part of GSUB be, and how hard will the shaper have to
+    # work? These are the estimates from flowify.sizes rather than a real
+    # compile, so they are quick enough to try out options with a dry run.
+    # Every glyph in a run goes through each lookup in the feature, and
+    # perhaps the lookups its rules call too, which gives the worst case.
+    def estimate(self):
+        compiler = binary.LookupCompiler(self.ff, None)
+        top_level = []
+        for routines in self.ff.features.values():
+            compiler.collect(routines)
+            top_level.extend(
+                r.routine if isinstance(r, RoutineReference) else r for r in routines
+            )
+        kerning_routines = set(getattr(self, "kerning_routines", []))
+
+        lookup_sizes = {}
+        subtables = 0
+        for routine in compiler.routines:
+            if routine in kerning_routines:
+                size = sizes.ChainingLookupSize()
+                for rule in routine.rules:
+                    size.add(
+                        compiler.glyphs(rule.input[0]),
+                        compiler.glyphs(rule.postcontext[0]),
+                        binary._routine(rule.lookups[0][0]),
+                    )
+                lookup_sizes[routine] = size.size()
+                subtables += size.subtables()
+                continue
+            if any(isinstance(rule, Chaining) for rule in routine.rules):
+                lookup_sizes[routine] = sizes.lookup_header_size(
+                    len(routine.rules)
+                ) + sum(
+                    sizes.chain_rule_size(
+                        [compiler.glyphs(x) for x in rule.precontext],
+                        [compiler.glyphs(x) for x in rule.input],
+                        [compiler.glyphs(x) for x in rule.postcontext],
+                        lookups=sum(len(x or []) for x in rule.lookups),
+                    )
+                    for rule in routine.rules
+                )
+                subtables += len(routine.rules)
+                continue
+            mapping = {}
+            for rule in routine.rules:
+                for glyph, sequence in compiler.substitutions(rule):
+                    mapping.setdefault(glyph, sequence)
+            if all(len(sequence) == 1 for sequence in mapping.values()):
+                size = sizes.single_subst_size(len(mapping))
+            else:
+                size = sizes.multiple_subst_size([len(x) for x in mapping.values()])
+            lookup_sizes[routine] = sizes.lookup_header_size(1) + size
+            subtables += 1
+
+        calls = {}
+
+        def lookups_called(routine):
+            if routine not in calls:
+                calls[routine] = max(
+                    [
+                        sum(
+                            1 + lookups_called(binary._routine(called))
+                            for lookuplist in rule.lookups
+                            for called in lookuplist or []
+                            if not compiler.is_empty(binary._routine(called))
+                        )
+                        for rule in routine.rules
+                        if isinstance(rule, Chaining)
+                    ]
+                    or [0]
+                )
+            return calls[routine]
+
+        # Routines which can't match anything are left out of the font
+        passes = [r for r in top_level if not compiler.is_empty(r)]
+        largest = max(lookup_sizes, key=lookup_sizes.get, default=None)
+        gsub_bytes = sizes.gsub_header_size(len(compiler.routines)) + sum(
+            lookup_sizes.values()
+        )
+        if gsub_bytes > 0xFFFF:
+            gsub_bytes += sizes.EXTENSION_SUBTABLE_SIZE * subtables
+        return {
+            "added_glyphs": len(self.added_glyphs),
+            "lookups": len(compiler.routines),
+            "subtables": subtables,
+            "gsub_bytes": gsub_bytes,
+            "largest_lookup": largest.name if largest else None,
+            "largest_lookup_bytes": lookup_sizes[largest] if largest else 0,
+            "lookups_over_limit": [
+                r.name for r, size in lookup_sizes.items() if size > 0xFFFF
+            ],
+            "lookups_per_glyph": len(passes),
+            "worst_case_lookups_per_glyph": sum(1 + lookups_called(r) for r in passes),
+        }
+
+
+# fontmake runs the filter on every master with the same options, so each
+# one gets its own feature file, named after its UFO (or its style, for a
+# font which doesn't have a path), or it would overwrite the last one's.
+def _font_fea_path(fea_path, font):
+    if fea_path is None:
+        return None
+    if font.path is not None:
+        name = os.path.splitext(os.path.basename(os.path.normpath(font.path)))[0]
+    else:
+        name = (font.info.styleName or "font").replace(" ", "")
+    root, extension = os.path.splitext(fea_path)
+    return "%s-%s%s" % (root, name, extension or ".fea")
 
 
 class FlowifyFilter(BaseFilter):
@@ -621,8 +1528,21 @@ class FlowifyFilter(BaseFilter):
         "no_blank": False,
         "shape": "pill",
         "feature": "rlig",
-        "max_kern_rules_per_lookup": 20,
+        "max_kern_rules_per_lookup": None,
         "debugging": False,
+        "engine": "adder",
+        "encoding": "glyph",
+        "kerning": "pairs",
+        "kern_grid": None,
+        "kern_buckets": None,
+        "arithmetic": "fixed",
+        "max_word_length": 20,
+        "pipeline": "separate",
+        "subset": None,
+        "stats": False,
+        "fea_path": None,
+        "cache_dir": None,
+        "cache_size": 100 * 1024 * 1024,
     }
 
     def __call__(self, font, glyphSet=None):
@@ -645,7 +1565,30 @@ class FlowifyFilter(BaseFilter):
             margin=self.options.margin,
             debugging=self.options.debugging,
             max_kern_rules_per_lookup=self.options.max_kern_rules_per_lookup,
+            engine=self.options.engine,
+            encoding=self.options.encoding,
+            kerning=self.options.kerning,
+            kern_grid=self.options.kern_grid,
+            kern_buckets=self.options.kern_buckets,
+            arithmetic=self.options.arithmetic,
+            max_word_length=self.options.max_word_length,
+            pipeline=self.options.pipeline,
+            subset=self.options.subset,
+            stats=self.options.stats,
+            fea_path=_font_fea_path(self.options.fea_path, font),
+            family_cache=family_cache,
+            cache_dir=self.options.cache_dir,
+            cache_size=self.options.cache_size,
         )
+        if self.options.stats:
+            logger.info("Flowify statistics for %s: %s", fontName, f.stats.as_json())
         for g in f.added_glyphs:
             glyphSet[g] = font[g]
-        return f.relevant_glyphs + f.added_glyphs
+        # ufo2ft compiles the glyph set, not the font, so the glyphs the
+        # subset emptied have to go in there too.
+        dropped = []
+        if f.subset_glyphs is not None:
+            dropped = [g for g in glyphSet if g in font and g not in f.kept_glyphs]
+            for g in dropped:
+                glyphSet[g] = font[g]
+        return f.relevant_glyphs + f.added_glyphs + dropped
@@ -0,0 +1,280 @@
+# This part of the code is all about turning our routines straight into
+# binary OpenType tables, so that we don't have to write out a huge feature
+# file and then have feaLib parse it all over again.
+
+from fontFeatures import Chaining, RoutineReference
+from fontTools.otlLib import builder as otl
+from fontTools.ttLib import newTable
+from fontTools.ttLib.tables import otTables as ot
+
+GDEF_CLASSES = {"base": 1, "ligature": 2, "mark": 3, "component": 4}
+
+
+def _routine(r):
+    if isinstance(r, RoutineReference):
+        return r.routine
+    return r
+
+
+class LookupCompiler:
+    def __init__(self, ff, ttfont):
+        self.ff = ff
+        self.font = ttfont
+        self.builders = {}
+        self.routines = []
+        self.empty = {}
+        self.mark_sets = {}
+        self.first_mark_set = 0
+        self.first_lookup = 0
+
+    # Class names (as used by fontFeatures when it writes feature code)
+    # get expanded back into the glyphs they stand for.
+    def glyphs(self, glyphs):
+        result = []
+        for g in glyphs:
+            if g.startswith("@"):
+                result.extend(self.glyphs(self.ff.namedClasses[g[1:]]))
+            else:
+                result.append(g)
+        return result
+
+    # A chain can only match if every position in it has a glyph; a
+    # substitution needs something to substitute.
+    def can_match(self, rule):
+        if isinstance(rule, Chaining):
+            return all(
+                self.glyphs(x) for x in rule.precontext + rule.input + rule.postcontext
+            )
+        return bool(self.glyphs(rule.input[0]))
+
+    # Routines whose rules can't match anything (a class with no glyphs in
+    # it, say) would build to nothing, so they are left out altogether, just
+    # as the feature code leaves out routines with no rules.
+    def is_empty(self, routine):
+        if routine not in self.empty:
+            self.empty[routine] = not any(self.can_match(r) for r in routine.rules)
+        return self.empty[routine]
+
+    # Find every routine we are going to need. The routines called from the
+    # feature come first, in order, because that is the order the shaper
+    # will run them in; anything only called from a chain comes afterwards.
+    def collect(self, routines):
+        pending = []
+        for r in routines:
+            r = _routine(r)
+            if not self.is_empty(r) and r not in self.routines:
+                self.routines.append(r)
+                pending.append(r)
+        nested = []
+        for r in pending:
+            for rule in r.rules:
+                if not isinstance(rule, Chaining):
+                    continue
+                for lookuplist in rule.lookups:
+                    nested.extend(lookuplist or [])
+        if nested:
+            self.collect(nested)
+
+    def mark_set(self, glyphs):
+        key = frozenset(self.glyphs(glyphs))
+        if key not in self.mark_sets:
+            self.mark_sets[key] = self.first_mark_set + len(self.mark_sets)
+        return self.mark_sets[key]
+
+    def substitutions(self, rule):
+        replacement = [self.glyphs(r) for r in rule.replacement]
+        for i, g in enumerate(self.glyphs(rule.input[0])):
+            yield g, [r[i] if len(r) > 1 else r[0] for r in replacement]
+
+    def make_builder(self, routine):
+        location = routine.name or "flowify"
+        if all(isinstance(rule, Chaining) for rule in routine.rules):
+            builder = otl.ChainContextSubstBuilder(self.font, location)
+        elif any(isinstance(rule, Chaining) for rule in routine.rules):
+            raise ValueError("Routine %s mixes chains and substitutions" % location)
+        elif all(len(rule.replacement) == 1 for rule in routine.rules):
+            builder = otl.SingleSubstBuilder(self.font, location)
+        else:
+            builder = otl.MultipleSubstBuilder(self.font, location)
+
+        # Just like the feature code, a mark filtering set only counts if
+        # the routine asks for it in its flags.
+        builder.lookupflag = routine.flags & ~otl.LOOKUP_FLAG_USE_MARK_FILTERING_SET
+        if routine.flags & otl.LOOKUP_FLAG_USE_MARK_FILTERING_SET:
+            builder.markFilterSet = self.mark_set(routine.markFilteringSet)
+        return builder
+
+    def fill_builder(self, builder, routine):
+        for rule in routine.rules:
+            if not self.can_match(rule):
+                continue
+            if isinstance(rule, Chaining):
+                lookups = []
+                for lookuplist in rule.lookups:
+                    called = [
+                        self.builders[_routine(r)]
+                        for r in lookuplist or []
+                        if not self.is_empty(_routine(r))
+                    ]
+                    lookups.append(called or None)
+                builder.rules.append(
+                    otl.ChainContextualRule(
+                        [set(self.glyphs(x)) for x in rule.precontext],
+                        [set(self.glyphs(x)) for x in rule.input],
+                        [set(self.glyphs(x)) for x in rule.postcontext],
+                        lookups,
+                    )
+                )
+                continue
+            for glyph, sequence in self.substitutions(rule):
+                if isinstance(builder, otl.SingleSubstBuilder):
+                    builder.mapping.setdefault(glyph, sequence[0])
+                else:
+                    builder.mapping.setdefault(glyph, sequence)
+
+    # Returns the new lookups, which are numbered from wherever the last
+    # call left off.
+    def compile(self, routines):
+        start = len(self.routines)
+        self.collect(routines)
+        new_routines = self.routines[start:]
+        for ix, routine in enumerate(new_routines, start):
+            builder = self.make_builder(routine)
+            builder.lookup_index = self.first_lookup + ix
+            self.builders[routine] = builder
+        lookups = []
+        for routine in new_routines:
+            self.fill_builder(self.builders[routine], routine)
+            lookups.append(self.builders[routine].build())
+        return lookups
+
+
+def _empty_gsub():
+    table = ot.GSUB()
+    table.Version = 0x00010000
+    table.ScriptList = ot.ScriptList()
+    table.ScriptList.ScriptRecord = []
+    table.FeatureList = ot.FeatureList()
+    table.FeatureList.FeatureRecord = []
+    table.LookupList = ot.LookupList()
+    table.LookupList.Lookup = []
+    gsub = newTable("GSUB")
+    gsub.table = table
+    return gsub
+
+
+def _empty_gdef():
+    table = ot.GDEF()
+    table.Version = 0x00010000
+    table.GlyphClassDef = None
+    table.AttachList = None
+    table.LigCaretList = None
+    table.MarkAttachClassDef = None
+    gdef = newTable("GDEF")
+    gdef.table = table
+    return gdef
+
+
+def _all_langsys(table):
+    if not table.ScriptList.ScriptRecord:
+        script = ot.ScriptRecord()
+        script.ScriptTag = "DFLT"
+        script.Script = ot.Script()
+        script.Script.LangSysRecord = []
+        script.Script.DefaultLangSys = ot.LangSys()
+        script.Script.DefaultLangSys.LookupOrder = None
+        script.Script.DefaultLangSys.ReqFeatureIndex = 0xFFFF
+        script.Script.DefaultLangSys.FeatureIndex = []
+        table.ScriptList.ScriptRecord.append(script)
+    for script in table.ScriptList.ScriptRecord:
+        if script.Script.DefaultLangSys:
+            yield script.Script.DefaultLangSys
+        for record in script.Script.LangSysRecord:
+            yield record.LangSys
+
+
+# Hook the lookups up to a feature in every language system, just as
+# feaLib would do with a feature block outside of any language statement.
+# If the font already has this feature, our lookups go on the end of it.
+def _add_feature(table, tag, lookup_indices):
+    records = table.FeatureList.FeatureRecord
+    new_record = None
+    extended = set()
+    for langsys in _all_langsys(table):
+        existing = [ix for ix in langsys.FeatureIndex if records[ix].FeatureTag == tag]
+        if existing:
+            feature = records[existing[0]].Feature
+            if id(feature) not in extended:
+                feature.LookupListIndex.extend(lookup_indices)
+                extended.add(id(feature))
+            continue
+        if new_record is None:
+            new_record = ot.FeatureRecord()
+            new_record.FeatureTag = tag
+            new_record.Feature = ot.Feature()
+            new_record.Feature.FeatureParams = None
+            new_record.Feature.LookupListIndex = list(lookup_indices)
+            records.append(new_record)
+        langsys.FeatureIndex.append(len(records) - 1)
+
+    # The feature list has to stay sorted by tag
+    order = sorted(range(len(records)), key=lambda ix: records[ix].FeatureTag)
+    remap = {old: new for new, old in enumerate(order)}
+    table.FeatureList.FeatureRecord = [records[ix] for ix in order]
+    for langsys in _all_langsys(table):
+        langsys.FeatureIndex = sorted(remap[ix] for ix in langsys.FeatureIndex)
+        if langsys.ReqFeatureIndex != 0xFFFF:
+            langsys.ReqFeatureIndex = remap[langsys.ReqFeatureIndex]
+
+
+def _add_gdef(ttfont, ff, mark_sets):
+    if "GDEF" not in ttfont:
+        ttfont["GDEF"] = _empty_gdef()
+    gdef = ttfont["GDEF"].table
+    if gdef.GlyphClassDef is None:
+        gdef.GlyphClassDef = ot.GlyphClassDef()
+        gdef.GlyphClassDef.classDefs = {}
+    for glyph, category in ff.glyphclasses.items():
+        gdef.GlyphClassDef.classDefs[glyph] = GDEF_CLASSES[category]
+
+    if not mark_sets:
+        return
+    if gdef.Version < 0x00010002:
+        gdef.Version = 0x00010002
+    if getattr(gdef, "MarkGlyphSetsDef", None) is None:
+        gdef.MarkGlyphSetsDef = ot.MarkGlyphSetsDef()
+        gdef.MarkGlyphSetsDef.MarkSetTableFormat = 1
+        gdef.MarkGlyphSetsDef.Coverage = []
+    glyphMap = ttfont.getReverseGlyphMap()
+    for glyphs, _ in sorted(mark_sets.items(), key=lambda item: item[1]):
+        gdef.MarkGlyphSetsDef.Coverage.append(otl.buildCoverage(glyphs, glyphMap))
+    gdef.MarkGlyphSetsDef.MarkSetCount = len(gdef.MarkGlyphSetsDef.Coverage)
+
+
+# Add the features of a FontFeatures object to an already-compiled font.
+# Our lookups go after the font's own lookups, exactly where they would
+# have ended up if we had appended feature code to the font's features.
+def add_features_to_font(ff, ttfont):
+    if "GSUB" not in ttfont:
+        ttfont["GSUB"] = _empty_gsub()
+    table = ttfont["GSUB"].table
+
+    compiler = LookupCompiler(ff, ttfont)
+    compiler.first_lookup = len(table.LookupList.Lookup)
+    if "GDEF" in ttfont:
+        existing_sets = getattr(ttfont["GDEF"].table, "MarkGlyphSetsDef", None)
+        if existing_sets is not None:
+            compiler.first_mark_set = len(existing_sets.Coverage)
+
+    for tag, routines in ff.features.items():
+        table.LookupList.Lookup.extend(compiler.compile(routines))
+        called = [
+            compiler.builders[_routine(r)].lookup_index
+            for r in routines
+            if _routine(r) in compiler.builders
+        ]
+        if called:
+            _add_feature(table, tag, called)
+    table.LookupList.LookupCount = len(table.LookupList.Lookup)
+
+    _add_gdef(ttfont, ff, compiler.mark_sets)
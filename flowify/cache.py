@@ -0,0 +1,150 @@
+# This part of the code is all about remembering what we built last time, so
+# that building the same font again (as CI does on every commit) can skip
+# straight to the answer.
+
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+
+from ufoLib2.objects import Contour, Glyph, Point
+
+# Bump this whenever a change to flowify changes what it builds, or what goes
+# into an entry, so that old cache entries stop matching. The package version
+# goes into the key too, so that releases never share entries.
+CACHE_VERSION = 4
+
+# importlib.metadata only arrived in Python 3.8
+try:
+    from importlib import metadata
+except ImportError:
+    try:
+        import importlib_metadata as metadata
+    except ImportError:
+        metadata = None
+try:
+    PACKAGE_VERSION = metadata.version("flowify") if metadata else None
+except metadata.PackageNotFoundError:
+    PACKAGE_VERSION = None
+
+
+# A hash of everything in the font that flowify looks at, along with the
+# options. Outlines and names don't change what we build, so they aren't
+# included. Codepoints, components and the font's feature code decide which
+# glyphs a subset keeps, so they are.
+def content_hash(font, options):
+    inputs = {
+        "version": CACHE_VERSION,
+        "package_version": PACKAGE_VERSION,
+        "options": options,
+        "glyphs": [
+            (g.name, g.width, sorted(g.unicodes), [c.baseGlyph for c in g.components])
+            for g in font
+        ],
+        "features": font.features.text,
+        "kerning": sorted([list(pair), value] for pair, value in font.kerning.items()),
+        "groups": sorted([name, list(members)] for name, members in font.groups.items()),
+        "categories": font.lib.get("public.openTypeCategories", {}),
+        "skip_export": sorted(font.lib.get("public.skipExportGlyphs", [])),
+        "x_height": font.info.xHeight,
+        "cap_height": font.info.capHeight,
+    }
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+# Entries hold routines, which are only ever made of these classes. Nothing
+# else is allowed out of a pickle, so that an entry can't be used to run
+# code; even so, the cache directory should be one only you can write to.
+ENTRY_CLASSES = {
+    ("collections", "OrderedDict"),
+    ("fontFeatures", "Chaining"),
+    ("fontFeatures", "FontFeatures"),
+    ("fontFeatures", "Routine"),
+    ("fontFeatures", "RoutineReference"),
+    ("fontFeatures", "Substitution"),
+}
+
+
+class EntryUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if (module, name) not in ENTRY_CLASSES:
+            raise pickle.UnpicklingError(
+                "%s.%s isn't allowed in a cache entry" % (module, name)
+            )
+        return super().find_class(module, name)
+
+
+# One pickle file per entry. Reading an entry touches it, and when the cache
+# grows past max_size bytes the least recently used entries go first.
+class DiskCache:
+    def __init__(self, directory, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def get(self, key):
+        try:
+            with open(self.path(key), "rb") as f:
+                entry = EntryUnpickler(f).load()
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        try:
+            os.utime(self.path(key))
+        except OSError:
+            pass
+        return entry
+
+    # Entries are written to a temporary file and moved into place, so that
+    # several processes can share a cache directory.
+    def put(self, key, entry):
+        fd, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path(key))
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".pickle"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+            total -= size
+
+
+# Glyphs are stored as plain data rather than as ufoLib2 objects
+def glyph_to_data(glyph):
+    return (
+        glyph.name,
+        glyph.width,
+        list(glyph.unicodes),
+        [[(p.x, p.y, p.type, p.smooth) for p in contour] for contour in glyph.contours],
+    )
+
+
+def glyph_from_data(data):
+    name, width, unicodes, contours = data
+    return Glyph(
+        name,
+        width=width,
+        unicodes=unicodes,
+        contours=[Contour(points=[Point(*p) for p in c]) for c in contours],
+    )
@@ -0,0 +1,291 @@
+# This part of the code is all about flowifying a font which has already
+# been compiled. We read what flowify needs out of the binary tables into a
+# stand-in UFO, run flowify on that, and then put the new glyphs and lookups
+# straight into the font, without going anywhere near fontmake.
+
+import logging
+
+from fontTools.pens.boundsPen import BoundsPen
+from fontTools.pens.cu2quPen import Cu2QuPen
+from fontTools.pens.t2CharStringPen import T2CharStringPen
+from fontTools.pens.ttGlyphPen import TTGlyphPen
+from ufoLib2 import Font
+
+import flowify.subset
+from flowify import Flowify
+
+logger = logging.getLogger(__name__)
+
+
+def _lookups(gpos, feature_tag):
+    table = gpos.table
+    if not table.FeatureList or not table.LookupList:
+        return []
+    indices = []
+    for record in table.FeatureList.FeatureRecord:
+        if record.FeatureTag == feature_tag:
+            for ix in record.Feature.LookupListIndex:
+                if ix not in indices:
+                    indices.append(ix)
+    return [table.LookupList.Lookup[ix] for ix in sorted(indices)]
+
+
+def _subtables(lookup):
+    for subtable in lookup.SubTable:
+        if lookup.LookupType == 9:
+            subtable = subtable.ExtSubTable
+        if subtable.LookupType == 2:
+            yield subtable
+
+
+def _x_advance(value):
+    return getattr(value, "XAdvance", 0) if value is not None else 0
+
+
+# Turn the pair adjustments of the kern feature back into UFO kerning. Pairs
+# from format 1 subtables become glyph-glyph kerning; each class of a format 2
+# subtable becomes a kerning group. Within a lookup, the shaper takes the
+# first subtable which kerns a pair, and so do we, so a pair kerned by zero
+# still has to be kept: it stops the pair falling through to a later
+# subtable. Separate lookups all get applied, though, and their kerning adds
+# up, so when there is more than one we work out which pairs of glyphs they
+# both kern, and put those in first with the total.
+def read_kerning(ttfont, font):
+    if "GPOS" not in ttfont:
+        return
+    lookups = _lookups(ttfont["GPOS"], "kern")
+    flatten = len(lookups) > 1
+    kerned = [
+        read_kern_lookup(ttfont, font, lookup_index, lookup, flatten)
+        for lookup_index, lookup in enumerate(lookups)
+    ]
+    if not flatten:
+        return
+
+    totals = {}
+    counts = {}
+    for pairs in kerned:
+        for pair, value in pairs:
+            totals[pair] = totals.get(pair, 0) + value
+            counts[pair] = counts.get(pair, 0) + 1
+    overlapping = {pair: totals[pair] for pair in totals if counts[pair] > 1}
+    if not overlapping:
+        return
+    kerning = dict(overlapping)
+    for pair, value in font.kerning.items():
+        kerning.setdefault(pair, value)
+    font.kerning.clear()
+    font.kerning.update(kerning)
+
+
+# Reads one lookup into the font's kerning, and with flatten, gives back the
+# pairs of glyphs it kerns, with their values. Every pair in a format 1
+# subtable counts, because flowify makes a rule for it even when it is zero,
+# but a format 2 subtable only kerns the pairs it gives a value to.
+def read_kern_lookup(ttfont, font, lookup_index, lookup, flatten):
+    glyph_order = ttfont.getGlyphOrder()
+    kerned = []
+    seen = set()
+    # A format 2 subtable matches every pair whose left glyph it covers,
+    # whatever the right glyph is, so those left glyphs are done with.
+    claimed = set()
+    for subtable_index, subtable in enumerate(_subtables(lookup)):
+        covered = subtable.Coverage.glyphs
+        if subtable.Format == 1:
+            for left, pairset in zip(covered, subtable.PairSet):
+                if left in claimed:
+                    continue
+                for record in pairset.PairValueRecord:
+                    pair = (left, record.SecondGlyph)
+                    if pair in seen:
+                        continue
+                    seen.add(pair)
+                    value = _x_advance(record.Value1)
+                    kerned.append((pair, value))
+                    font.kerning.setdefault(pair, value)
+            continue
+
+        # Glyphs in the coverage table but not in ClassDef1 are class 0 on
+        # the left; anything not in ClassDef2 is class 0 on the right.
+        # Zero values in here don't need keeping, because the left glyphs
+        # are claimed instead.
+        prefix = "%i_%i_" % (lookup_index, subtable_index)
+        class_def1 = subtable.ClassDef1.classDefs
+        class_def2 = subtable.ClassDef2.classDefs
+        left_classes = {}
+        for glyph in covered:
+            if glyph not in claimed:
+                left_classes.setdefault(class_def1.get(glyph, 0), []).append(glyph)
+        right_classes = {}
+        for glyph in glyph_order:
+            right_classes.setdefault(class_def2.get(glyph, 0), []).append(glyph)
+        for class1, record in enumerate(subtable.Class1Record):
+            if class1 not in left_classes:
+                continue
+            for class2, class2_record in enumerate(record.Class2Record):
+                value = _x_advance(class2_record.Value1)
+                if not value or class2 not in right_classes:
+                    continue
+                left = "public.kern1.%s%i" % (prefix, class1)
+                right = "public.kern2.%s%i" % (prefix, class2)
+                font.groups[left] = left_classes[class1]
+                font.groups[right] = right_classes[class2]
+                font.kerning[(left, right)] = value
+                if not flatten:
+                    continue
+                kerned.extend(
+                    ((l, r), value)
+                    for l in left_classes[class1]
+                    for r in right_classes[class2]
+                    if (l, r) not in seen
+                )
+        claimed.update(covered)
+    return kerned
+
+
+def _name(ttfont, name_id):
+    name = ttfont["name"]
+    record = name.getName(name_id, 3, 1, 0x409) or name.getName(name_id, 1, 0, 0)
+    return record.toUnicode() if record else None
+
+
+# A UFO with just enough in it for flowify: glyph names and advance widths,
+# mark categories from GDEF, kerning from GPOS and the vertical metrics.
+def font_from_binary(ttfont):
+    font = Font()
+    hmtx = ttfont["hmtx"]
+    for name in ttfont.getGlyphOrder():
+        font.newGlyph(name).width = hmtx[name][0]
+    for codepoint, name in ttfont.getBestCmap().items():
+        font[name].unicodes.append(codepoint)
+
+    if "GDEF" in ttfont and ttfont["GDEF"].table.GlyphClassDef:
+        categories = ttfont["GDEF"].table.GlyphClassDef.classDefs
+        font.lib["public.openTypeCategories"] = {
+            name: "mark" for name, category in categories.items() if category == 3
+        }
+    read_kerning(ttfont, font)
+
+    os2 = ttfont["OS/2"] if "OS/2" in ttfont else None
+    if os2 is not None and os2.version >= 2:
+        font.info.xHeight = os2.sxHeight or None
+        font.info.capHeight = os2.sCapHeight or None
+    font.info.unitsPerEm = ttfont["head"].unitsPerEm
+    font.info.familyName = _name(ttfont, 16) or _name(ttfont, 1)
+    return font
+
+
+def _add_truetype_glyph(ttfont, glyph):
+    pen = TTGlyphPen(None)
+    glyph.draw(Cu2QuPen(pen, max_err=1.0, reverse_direction=True))
+    ttglyph = pen.glyph()
+    ttglyph.recalcBounds(ttfont["glyf"])
+    ttfont["glyf"][glyph.name] = ttglyph
+    return getattr(ttglyph, "xMin", 0)
+
+
+def _add_cff_glyph(ttfont, glyph):
+    cff = ttfont["CFF "].cff
+    top = cff[cff.fontNames[0]]
+    private = top.Private
+    width = glyph.width
+    if width == getattr(private, "defaultWidthX", 0):
+        width = None
+    else:
+        width -= getattr(private, "nominalWidthX", 0)
+    pen = T2CharStringPen(width, None)
+    glyph.draw(pen)
+    charstring = pen.getCharString(private=private, globalSubrs=cff.GlobalSubrs)
+    charstrings = top.CharStrings
+    charstrings.charStringsIndex.append(charstring)
+    charstrings.charStrings[glyph.name] = len(charstrings.charStringsIndex) - 1
+    top.charset.append(glyph.name)
+    bounds = BoundsPen(None)
+    glyph.draw(bounds)
+    return bounds.bounds[0] if bounds.bounds else 0
+
+
+# Copy the glyphs flowify added to the stand-in UFO into the binary font.
+def add_glyphs(ttfont, font, names):
+    glyph_order = ttfont.getGlyphOrder() + list(names)
+    ttfont.setGlyphOrder(glyph_order)
+    if "glyf" in ttfont:
+        ttfont["glyf"].glyphOrder = glyph_order
+    cmap_subtables = [t for t in ttfont["cmap"].tables if t.isUnicode()]
+    for name in names:
+        glyph = font[name]
+        if "glyf" in ttfont:
+            lsb = _add_truetype_glyph(ttfont, glyph)
+        else:
+            lsb = _add_cff_glyph(ttfont, glyph)
+        ttfont["hmtx"][name] = (int(round(glyph.width)), int(round(lsb)))
+        if "vmtx" in ttfont:
+            ttfont["vmtx"][name] = (ttfont["head"].unitsPerEm, 0)
+        for codepoint in glyph.unicodes:
+            for subtable in cmap_subtables:
+                if subtable.format == 12 or (
+                    subtable.format == 4 and codepoint <= 0xFFFF
+                ):
+                    subtable.cmap[codepoint] = name
+
+    # These hold a value for every glyph, and are only hints, so we drop
+    # them rather than leave them out of date.
+    for tag in ["hdmx", "LTSH"]:
+        if tag in ttfont:
+            logger.info("Removing the %s table", tag)
+            del ttfont[tag]
+
+
+def add_flow_to_names(ttfont):
+    family = _name(ttfont, 16) or _name(ttfont, 1)
+    for record in ttfont["name"].names:
+        value = record.toUnicode()
+        if record.nameID in (1, 16):
+            value += " Flow"
+        elif record.nameID == 4:
+            if family and value.startswith(family):
+                value = family + " Flow" + value[len(family) :]
+            else:
+                value += " Flow"
+        elif record.nameID == 6:
+            head, dash, tail = value.partition("-")
+            value = head + "Flow" + dash + tail
+        else:
+            continue
+        record.string = value
+
+
+# Flowify a compiled TTF or OTF in place. Takes the same options as Flowify,
+# apart from output, which is always binary.
+def flowify_compiled_font(ttfont, **kwargs):
+    if "CFF2" in ttfont or "fvar" in ttfont:
+        raise ValueError("Flowify cannot be used on variable fonts")
+    if kwargs.get("engine") == "fast":
+        raise ValueError(
+            "The fast engine needs to recompile the font's kerning, "
+            "so it can't be used on a compiled font"
+        )
+    # A compiled font can be subset properly before we start, and then
+    # flowified as a whole. A dry run mustn't touch the font, so it makes do
+    # with flowifying only the subset's glyphs.
+    if not kwargs.get("dry_run"):
+        subset = kwargs.pop("subset", None)
+        if subset is not None:
+            flowify.subset.subset_binary(ttfont, spec=subset)
+    font = font_from_binary(ttfont)
+    slug_height = kwargs.get("slug_height", "x")
+    if slug_height in ("x", "cap") and not (
+        font.info.xHeight if slug_height == "x" else font.info.capHeight
+    ):
+        raise ValueError(
+            "This font's OS/2 table has no %s-height; give the slug height in units"
+            % slug_height
+        )
+    kwargs["output"] = "binary"
+    result = Flowify(font, **kwargs)
+    if result.dry_run:
+        return result
+    add_glyphs(ttfont, font, result.added_glyphs)
+    result.add_to_binary_font(ttfont)
+    add_flow_to_names(ttfont)
+    return result
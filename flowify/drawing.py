@@ -1,5 +1,7 @@
 # This part of the code is all about drawing the glyphs we need.
 
+from ufoLib2.objects import Contour, Glyph, Point
+
 # Length of cubic Bezier handle used when drawing quarter circles.
 # See https://pomax.github.io/bezierinfo/#circles_cubic
 CIRCULAR_SUPERNESS = 0.551784777779014
@@ -60,3 +62,15 @@ def draw_slug(glyph, width, height):
     pen.lineTo((0, height))
     pen.closePath()
 
+
+# Our glyphs are nothing but simple contours, so copying them point by point
+# is a lot quicker than Glyph.copy(), which deep-copies everything.
+def copy_glyph(glyph):
+    return Glyph(
+        glyph.name,
+        width=glyph.width,
+        contours=[
+            Contour(points=[Point(p.x, p.y, p.type, p.smooth) for p in contour])
+            for contour in glyph.contours
+        ],
+    )
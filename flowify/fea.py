@@ -0,0 +1,123 @@
+# This part of the code is all about writing out feature code. fontFeatures'
+# asFea() builds an AST for every lookup in the font before turning any of it
+# into text, and then hands back the whole thing as one string; with a lot
+# of kerning that can be hundreds of megabytes. This does the same work, but
+# turns each lookup into text and writes it out as soon as it has been made.
+
+import copy
+
+import fontTools.feaLib.ast as feaast
+from fontFeatures import Routine
+from fontFeatures.feaLib.FontFeatures import (
+    _to_inline_class,
+    add_gdef,
+    add_language_system_statements,
+    reorderAndResolve,
+)
+from fontFeatures.feaLib.Routine import lookup_type
+
+
+# The statements of ff.asFeaAST(), one at a time. This follows fontFeatures
+# step by step, so the feature code is the same as asFea() would give.
+def fea_statements(ff):
+    header = feaast.FeatureFile()
+    add_language_system_statements(ff, header)
+    add_gdef(ff, header)
+    yield from header.statements
+
+    # Split routines into one lookup per language and lookup type
+    for references in ff.features.values():
+        for reference in references:
+            routine = reference.routine
+            rules = []
+            for rule in routine.rules:
+                if len(rule.languages or []) > 1:
+                    for language in rule.languages:
+                        new_rule = copy.copy(rule)
+                        new_rule.languages = [language]
+                        rules.append(new_rule)
+                else:
+                    rules.append(rule)
+            routine.rules = rules
+            partitioned = ff.partitionRoutine(
+                routine,
+                lambda rule: tuple(
+                    [tuple(rule.languages or []), type(rule), lookup_type(rule)]
+                ),
+            )
+            if routine.name and partitioned and len(partitioned) > 1:
+                for part in partitioned:
+                    rule = part.rules[0]
+                    language = (rule.languages or [("DFLT", "dflt")])[0]
+                    part.name = part.name + "%s_%s_%s_%i" % (
+                        language[0].strip(),
+                        language[1].strip(),
+                        type(rule).__name__,
+                        lookup_type(rule),
+                    )
+
+    for routine in ff.routines:
+        routine.usecount = 0
+        if routine.rules and not routine.flags:
+            routine.flags = routine.rules[0].flags
+        if routine.rules and not routine.languages:
+            routine.languages = routine.rules[0].languages
+
+    for feature, references in ff.features.items():
+        split = []
+        for reference in references:
+            routine = reference.routine
+            if len(routine.languages or []) > 1:
+                for language in routine.languages:
+                    new_reference = copy.copy(reference)
+                    new_reference.languages = [language]
+                    split.append(new_reference)
+            else:
+                split.append(reference)
+                reference.languages = routine.languages
+        ff.features[feature] = split
+
+    routines = [ff.routines[i] for i in reorderAndResolve(ff)]
+
+    # The preambles can add named classes, so they all have to be done
+    # before the classes are written.
+    preamble = []
+    for routine in routines:
+        assert isinstance(routine, Routine)
+        if not routine.name and routine.usecount != 1:
+            routine.name = ff.gensym("Routine_")
+        statements = routine.feaPreamble(ff)
+        if routine.rules:
+            preamble.extend(statements)
+    yield from preamble
+
+    for name, glyphs in ff.namedClasses.items():
+        yield feaast.GlyphClassDefinition(name, _to_inline_class(glyphs))
+    yield feaast.Comment("")
+
+    for routine in routines:
+        if routine.rules:
+            yield routine.asFeaAST()
+
+    for feature, references in ff.features.items():
+        for reference in references:
+            block = feaast.FeatureBlock(feature)
+            language = reference.languages
+            if language:
+                block.statements.append(feaast.ScriptStatement(language[0][0]))
+                block.statements.append(feaast.LanguageStatement("%4s" % language[0][1]))
+            block.statements.append(reference.asFeaAST(expand=feature == "aalt"))
+            yield block
+
+
+# Write the feature code for ff to a file-like object, and return the number
+# of characters written.
+def write_fea(ff, stream):
+    written = 0
+    for i, statement in enumerate(fea_statements(ff)):
+        text = statement.asFea()
+        if i:
+            text = "\n" + text
+        stream.write(text)
+        written += len(text)
+    return written
@@ -1,8 +1,20 @@
 import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
 from flowify import Flowify
+from flowify.compiled import flowify_compiled_font
+from flowify.watch import Watcher
+from fontTools.designspaceLib import DesignSpaceDocument
+from fontTools.ttLib import TTFont
+from ufo2ft import compileTTF
 from ufoLib2 import Font
 
-parser = argparse.ArgumentParser(description="Turn a font into a flow font.")
+parser = argparse.ArgumentParser(prog="flowify", description="Turn a font into a flow font.")
 parser.add_argument(
     "--slug-height",
     default="x",
@@ -26,6 +38,60 @@ parser.add_argument(
     choices=["pill", "rectangle"],
     help="shape of slug",
 )
+parser.add_argument(
+    "--engine",
+    default="adder",
+    choices=["adder", "fast"],
+    help="'fast' swaps each glyph for a rectangle instead of adding up widths (rectangles only)",
+)
+parser.add_argument(
+    "--encoding",
+    default="glyph",
+    choices=["glyph", "width"],
+    help="'width' encodes each distinct advance width once, for fonts with many glyphs of the same width",
+)
+parser.add_argument(
+    "--kerning",
+    default="pairs",
+    choices=["pairs", "classes"],
+    help="'classes' turns group kerning into a few class-based lookups instead of one rule per pair",
+)
+parser.add_argument(
+    "--kern-grid",
+    type=int,
+    help="Round kern values to a multiple of this many units, so there are fewer of them",
+)
+parser.add_argument(
+    "--kern-buckets",
+    type=int,
+    help="Cluster kern values into at most this many different values",
+)
+parser.add_argument(
+    "--max-kern-rules-per-lookup",
+    help="Number of kerning rules in each lookup, or 'auto' to pack them by size (default: 20 for pair kerning, auto for class-based kerning)",
+)
+parser.add_argument(
+    "--arithmetic",
+    default="fixed",
+    choices=["fixed", "auto"],
+    help="'auto' picks the smallest adder which can hold the widest expected word",
+)
+parser.add_argument(
+    "--max-word-length",
+    default=20,
+    type=int,
+    help="Longest word (in glyphs) that --arithmetic=auto has to allow for",
+)
+parser.add_argument(
+    "--pipeline",
+    default="separate",
+    choices=["separate", "fused"],
+    help="'fused' adds the word markers and tidies up afterwards in fewer lookups, so shaping is quicker",
+)
+parser.add_argument(
+    "--subset",
+    help="Only keep the glyphs for these Unicode ranges and scripts, e.g. 'U+0000-00FF,U+2000-206F' or 'Latn,Grek'",
+)
 parser.add_argument(
     "--margin", default=20, type=int, help="Sidebearings of semicircular ends"
 )
@@ -34,19 +100,249 @@ parser.add_argument(
     default="rlig",
     help="OpenType feature to contain flowification lookups",
 )
-parser.add_argument("input", help="UFO file to convert")
-parser.add_argument("output", help="Filename of new UFO")
+parser.add_argument(
+    "--binary",
+    action="store_true",
+    help="Compile to a TTF and add the flow lookups to it directly, instead of writing feature code",
+)
+parser.add_argument(
+    "--separate-fea",
+    action="store_true",
+    help="Write the flow lookups to a .fea file next to the output UFO, and include() it from the UFO's features",
+)
+parser.add_argument(
+    "--stats",
+    action="store_true",
+    help="Print the time and peak memory taken by each stage, and the sizes of things built, as JSON",
+)
+parser.add_argument(
+    "--cache-dir",
+    help="Directory in which to keep the results of previous runs, and reuse them when a font hasn't changed",
+)
+parser.add_argument(
+    "--cache-size",
+    default=100,
+    type=int,
+    help="Maximum size of the cache directory in megabytes (default 100); the least recently used entries are removed first",
+)
+parser.add_argument(
+    "--output-dir",
+    help="Convert every input into this directory (batch mode); each output is named after its input, with 'Flow' added",
+)
+parser.add_argument(
+    "--workers",
+    default=os.cpu_count() or 1,
+    type=int,
+    help="Number of fonts to convert at once in batch mode (default: one per CPU)",
+)
+parser.add_argument(
+    "--watch",
+    action="store_true",
+    help="Keep running, and update the output UFO whenever the input UFO changes",
+)
+parser.add_argument(
+    "--dry-run",
+    action="store_true",
+    help="Don't write anything; print estimates of the GSUB size, lookups and added glyphs for each input, as JSON",
+)
+parser.add_argument(
+    "paths",
+    nargs="+",
+    help="Input UFO (or compiled TTF/OTF) and output filename; or with --output-dir or --dry-run, any number of UFOs, compiled fonts, directories of UFOs and .designspace files",
+)
 
-args = parser.parse_args()
-font = Font.open(args.input)
 
-Flowify(
-    font,
-    args.slug_height,
-    no_blank=args.no_blank,
-    shape=args.shape,
-    margin=args.margin,
-    debugging=args.debugging,
-    feature=args.feature,
-)
-font.save(args.output, overwrite=True)
+def flowify_options(args):
+    return dict(
+        slug_height=args.slug_height,
+        no_blank=args.no_blank,
+        shape=args.shape,
+        margin=args.margin,
+        debugging=args.debugging,
+        feature=args.feature,
+        output="binary" if args.binary else "fea",
+        engine=args.engine,
+        encoding=args.encoding,
+        kerning=args.kerning,
+        kern_grid=args.kern_grid,
+        kern_buckets=args.kern_buckets,
+        arithmetic=args.arithmetic,
+        max_word_length=args.max_word_length,
+        pipeline=args.pipeline,
+        subset=args.subset,
+        max_kern_rules_per_lookup=(
+            args.max_kern_rules_per_lookup
+            if args.max_kern_rules_per_lookup in (None, "auto")
+            else int(args.max_kern_rules_per_lookup)
+        ),
+        stats=args.stats,
+        cache_dir=args.cache_dir,
+        cache_size=args.cache_size * 1024 * 1024,
+    )
+
+
+# The options for one output file: with --separate-fea, each UFO gets its
+# own feature file alongside it.
+def file_options(args, options, output):
+    if args.separate_fea and not is_compiled_font(output):
+        return dict(options, fea_path=os.path.splitext(output)[0] + ".fea")
+    return options
+
+
+# Convert one font. This runs in a worker process in batch mode, so it takes
+# and returns only simple things.
+def flowify_file(input, output, options):
+    if is_compiled_font(input):
+        ttfont = TTFont(input)
+        options = dict(options, output="binary")
+        flowify = flowify_compiled_font(ttfont, **options)
+        with flowify.stats.stage("save"):
+            ttfont.save(output)
+        return flowify.stats.as_dict()
+
+    font = Font.open(input)
+    # The include() for a separate feature file is relative to the UFO, so
+    # the UFO has to be where it's going before we write it.
+    if options.get("fea_path") is not None and os.path.dirname(
+        os.path.abspath(input)
+    ) != os.path.dirname(os.path.abspath(output)):
+        font.save(output, overwrite=True)
+    flowify = Flowify(font, **options)
+    if options["output"] == "binary":
+        with flowify.stats.stage("compile"):
+            ttfont = compileTTF(font)
+        flowify.add_to_binary_font(ttfont)
+        with flowify.stats.stage("save"):
+            ttfont.save(output)
+    else:
+        with flowify.stats.stage("save"):
+            font.save(output, overwrite=True)
+    return flowify.stats.as_dict()
+
+
+# In batch mode one bad font shouldn't stop the rest, so errors come back as
+# text along with how long the job took.
+def timed_flowify_file(input, output, options):
+    start = time.perf_counter()
+    try:
+        result, error = flowify_file(input, output, options), None
+    except Exception as e:
+        result, error = None, "%s: %s" % (type(e).__name__, e)
+    return time.perf_counter() - start, result, error
+
+
+# Directories stand for all the UFOs inside them, and designspace files for
+# all their masters.
+def expand_inputs(paths):
+    inputs = []
+    for path in paths:
+        if path.endswith(".designspace"):
+            designspace = DesignSpaceDocument.fromfile(path)
+            inputs.extend(source.path for source in designspace.sources)
+        elif os.path.isdir(path) and not path.rstrip("/").endswith(".ufo"):
+            inputs.extend(
+                os.path.join(path, name)
+                for name in sorted(os.listdir(path))
+                if name.endswith(".ufo")
+            )
+        else:
+            inputs.append(path)
+    # Sparse layers in a designspace share their master's UFO
+    return list(dict.fromkeys(os.path.normpath(x) for x in inputs))
+
+
+def is_compiled_font(path):
+    return os.path.splitext(path)[1].lower() in (".ttf", ".otf")
+
+
+def output_path(input, output_dir, binary):
+    stem, extension = os.path.splitext(os.path.basename(input))
+    if not is_compiled_font(input):
+        extension = ".ttf" if binary else ".ufo"
+    return os.path.join(output_dir, stem + "Flow" + extension)
+
+
+def run_batch(args, options):
+    inputs = expand_inputs(args.paths)
+    if not inputs:
+        parser.error("No UFOs found in %s" % ", ".join(args.paths))
+    outputs = [output_path(x, args.output_dir, args.binary) for x in inputs]
+    if len(set(outputs)) != len(outputs):
+        parser.error("Two inputs have the same name and would overwrite each other")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    failures = 0
+    stats = {}
+    with ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        jobs = {
+            executor.submit(
+                timed_flowify_file, input, output, file_options(args, options, output)
+            ): (input, output)
+            for input, output in zip(inputs, outputs)
+        }
+        for job in as_completed(jobs):
+            input, output = jobs[job]
+            elapsed, result, error = job.result()
+            if error:
+                failures += 1
+                print("FAILED %s (%.2fs): %s" % (input, elapsed, error), file=sys.stderr)
+            else:
+                stats[input] = result
+                print("%s -> %s (%.2fs)" % (input, output, elapsed), file=sys.stderr)
+    print(
+        "%i converted, %i failed" % (len(inputs) - failures, failures), file=sys.stderr
+    )
+    if args.stats:
+        print(json.dumps(stats, indent=2))
+    return 1 if failures else 0
+
+
+# A dry run builds everything but the output, so the fonts are left alone
+def estimate_file(input, options):
+    if is_compiled_font(input):
+        return flowify_compiled_font(TTFont(input), dry_run=True, **options).estimate()
+    return Flowify(Font.open(input), dry_run=True, **options).estimate()
+
+
+def run_dry(args, options):
+    inputs = expand_inputs(args.paths)
+    if not inputs:
+        parser.error("No UFOs found in %s" % ", ".join(args.paths))
+    estimates = {input: estimate_file(input, options) for input in inputs}
+    print(json.dumps(estimates, indent=2))
+    return 0
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    if args.separate_fea and args.binary:
+        parser.error("--separate-fea writes feature code, so it can't be used with --binary")
+    options = flowify_options(args)
+    if args.dry_run:
+        if args.watch:
+            parser.error("--watch can't be used with --dry-run")
+        return run_dry(args, options)
+    if args.output_dir:
+        if args.watch:
+            parser.error("--watch can't be used with --output-dir")
+        return run_batch(args, options)
+    if len(args.paths) != 2:
+        parser.error("Give an input UFO and an output filename, or use --output-dir")
+    if args.watch:
+        if args.binary or is_compiled_font(args.paths[0]):
+            parser.error("--watch reads and writes UFOs, so it can't be used with binary fonts")
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        Watcher(
+            args.paths[0], args.paths[1], **file_options(args, options, args.paths[1])
+        ).run()
+        return 0
+    stats = flowify_file(
+        args.paths[0], args.paths[1], file_options(args, options, args.paths[1])
+    )
+    if args.stats:
+        print(json.dumps(stats, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
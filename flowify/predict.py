@@ -0,0 +1,252 @@
+# This part of the code is all about working out what a flow font will do to
+# some text without shaping it. Everything the adder does comes down to a
+# few numbers for each glyph: a word is a run of relevant glyphs, its total
+# is the sum of their advances and the kerning between them (modulo the size
+# of the adder), and the total decides whether it gets a pill, a blank or a
+# rectangle. A SlugLayout holds those numbers, can be saved as JSON, and
+# measures whole batches of glyph sequences at once with NumPy.
+
+import json
+
+PILL = "pill"
+BLANK = "blank"
+RECTANGLE = "rectangle"
+
+
+class SlugLayout:
+    def __init__(
+        self,
+        advances,
+        relevant,
+        kerning,
+        marks,
+        skipped_marks,
+        slug_height,
+        modulus,
+        shape="pill",
+        no_blank=False,
+        caps=(0, 0),
+    ):
+        self.advances = dict(advances)
+        self.relevant = list(relevant)
+        self.kerning = dict(kerning)
+        self.marks = set(marks)
+        self.skipped_marks = set(skipped_marks)
+        self.slug_height = slug_height
+        self.modulus = modulus
+        self.shape = shape
+        self.no_blank = no_blank
+        self.caps = tuple(caps)
+        self.arrays = None
+
+    # The layout of a flow font which Flowify has just built (with the
+    # adder; the fast engine leaves kerning to GPOS).
+    @classmethod
+    def from_flowify(cls, f):
+        if f.engine != "adder":
+            raise ValueError("Only the adder engine's slugs can be predicted")
+        marks = f.ff.namedClasses["flow_marks"]
+        # Marks only leave words alone if the compiled font's GDEF says they
+        # are marks. Feature code brings its own GDEF, with just our glyphs in.
+        if f.output == "binary":
+            categories = f.font.lib.get("public.openTypeCategories", {})
+            skipped_marks = [g for g in marks if categories.get(g) == "mark"]
+        else:
+            skipped_marks = []
+        return cls(
+            advances={g: f.font[g].width for g in f.actual_glyphs},
+            relevant=f.relevant_glyphs,
+            kerning=flattened_kerning(f),
+            marks=marks,
+            skipped_marks=skipped_marks,
+            slug_height=int(f.slug_height),
+            modulus=f.BASE ** f.PLACES,
+            shape=f.shape,
+            no_blank=f.no_blank,
+            caps=(f.font["slug.left"].width, f.font["slug.right"].width),
+        )
+
+    def as_dict(self):
+        return {
+            "advances": self.advances,
+            "relevant": self.relevant,
+            "kerning": [[l, r, value] for (l, r), value in self.kerning.items()],
+            "marks": sorted(self.marks),
+            "skipped_marks": sorted(self.skipped_marks),
+            "slug_height": self.slug_height,
+            "modulus": self.modulus,
+            "shape": self.shape,
+            "no_blank": self.no_blank,
+            "caps": list(self.caps),
+        }
+
+    def as_json(self):
+        return json.dumps(self.as_dict())
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data["kerning"] = {(l, r): value for l, r, value in data["kerning"]}
+        return cls(**data)
+
+    # The per-glyph numbers as arrays, indexed by glyph
+    def glyph_arrays(self):
+        if self.arrays is not None:
+            return self.arrays
+        np = _numpy()
+        names = list(self.advances)
+        index = {g: i for i, g in enumerate(names)}
+        relevant = np.zeros(len(names), dtype=bool)
+        relevant[[index[g] for g in self.relevant if g in index]] = True
+        deleted = np.zeros(len(names), dtype=bool)
+        deleted[[index[g] for g in self.marks if g in index]] = True
+        skipped = np.zeros(len(names), dtype=bool)
+        skipped[[index[g] for g in self.skipped_marks if g in index]] = True
+        advances = np.array([self.advances[g] for g in names], dtype=np.float64)
+        # What each width adds to the sum, the way encode() stores it
+        encoded = np.array(
+            [int(self.modulus + w if w < 0 else w) % self.modulus for w in advances],
+            dtype=np.int64,
+        )
+        pairs = sorted(
+            (index[l] * len(names) + index[r], value)
+            for (l, r), value in self.kerning.items()
+            if l in index and r in index
+        )
+        kern_keys = np.array([key for key, _ in pairs], dtype=np.int64)
+        kern_values = np.array(
+            [int(self.modulus + v if v < 0 else v) % self.modulus for _, v in pairs],
+            dtype=np.int64,
+        )
+        self.arrays = (
+            index,
+            relevant,
+            deleted,
+            skipped,
+            np.floor(advances + 0.5).astype(np.int64),
+            encoded,
+            kern_keys,
+            kern_values,
+        )
+        return self.arrays
+
+    # Lay out a batch of glyph sequences (lists of glyph names, after the
+    # font's own substitutions). Returns a dict of arrays: for every word,
+    # the sequence it is in, the positions of its first glyph and the glyph
+    # after its last, its advance width and its shape (pill, blank or
+    # rectangle); and for every sequence, its total advance width.
+    def predict(self, sequences):
+        np = _numpy()
+        (
+            index,
+            relevant,
+            deleted,
+            skipped,
+            advances,
+            encoded,
+            kern_keys,
+            kern_values,
+        ) = self.glyph_arrays()
+        lengths = np.array([len(s) for s in sequences], dtype=np.int64)
+        try:
+            ids = np.fromiter(
+                (index[g] for s in sequences for g in s),
+                dtype=np.int64,
+                count=int(lengths.sum()),
+            )
+        except KeyError as e:
+            raise ValueError("Glyph %s isn't in the flow font" % e)
+        sequence = np.repeat(np.arange(len(sequences)), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        position = np.arange(len(ids)) - np.repeat(offsets, lengths)
+
+        # Skipped marks aren't there as far as finding words is concerned;
+        # any other glyph which isn't relevant ends a word.
+        visible = ~skipped[ids]
+        v_ids = ids[visible]
+        v_sequence = sequence[visible]
+        v_position = position[visible]
+        v_relevant = relevant[v_ids]
+        follows = np.zeros(len(v_ids), dtype=bool)
+        follows[1:] = (
+            v_relevant[1:] & v_relevant[:-1] & (v_sequence[1:] == v_sequence[:-1])
+        )
+        starts = v_relevant & ~follows
+        word = np.cumsum(starts) - 1
+
+        in_word = np.flatnonzero(v_relevant)
+        words = int(starts.sum())
+        total = np.bincount(
+            word[in_word], weights=encoded[v_ids[in_word]], minlength=words
+        )
+
+        # Kerning goes between neighbouring glyphs of the same word
+        right = np.flatnonzero(follows)
+        if len(right) and len(kern_keys):
+            keys = v_ids[right - 1] * len(index) + v_ids[right]
+            found = np.minimum(np.searchsorted(kern_keys, keys), len(kern_keys) - 1)
+            kerned = kern_keys[found] == keys
+            total += np.bincount(
+                word[right[kerned]],
+                weights=kern_values[found[kerned]],
+                minlength=words,
+            )
+        total = total.astype(np.int64) % self.modulus
+
+        if self.shape == "pill":
+            pill = total > self.slug_height
+            caps = int(round(sum(self.caps)))
+            width = np.where(
+                pill, caps + (total - self.slug_height) % self.modulus, total
+            )
+            shape = np.where(pill, PILL, RECTANGLE if self.no_blank else BLANK)
+        else:
+            width = total
+            shape = np.full(words, RECTANGLE)
+
+        ends = np.zeros(words, dtype=np.int64)
+        ends[word[in_word]] = v_position[in_word] + 1
+
+        # Glyphs outside words keep their own advances, unless they are marks
+        others = ~relevant[ids] & ~deleted[ids]
+        advance = np.bincount(
+            sequence[others], weights=advances[ids[others]], minlength=len(sequences)
+        ) + np.bincount(v_sequence[starts], weights=width, minlength=len(sequences))
+
+        return {
+            "word_sequence": v_sequence[starts],
+            "word_start": v_position[starts],
+            "word_end": ends,
+            "width": width,
+            "shape": shape,
+            "advance": advance.astype(np.int64),
+        }
+
+
+# Every pair of relevant glyphs which gets kerned, with the value it gets.
+# The kerning lookups are tried in order and the first rule which matches a
+# pair wins, so the first entry for each pair is the one that counts.
+def flattened_kerning(f):
+    entries = list(f.font.kerning.items())
+    if f.kerning == "classes":
+        order = [(False, False), (False, True), (True, False), (True, True)]
+        entries.sort(
+            key=lambda entry: order.index(
+                (entry[0][0] in f.font.groups, entry[0][1] in f.font.groups)
+            )
+        )
+    flat = {}
+    for (l, r), value in entries:
+        value = f.kern_values[value]
+        for left in f.kerning_side(l):
+            for right in f.kerning_side(r):
+                flat.setdefault((left, right), value)
+    return flat
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("Predicting slug layouts needs numpy: pip install numpy")
+    return numpy
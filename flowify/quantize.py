@@ -0,0 +1,75 @@
+# This part of the code is all about making do with fewer kern values. Every
+# distinct kern value gets a lookup of its own to insert its encoded form,
+# and fonts with interpolated or optically tuned kerning can have hundreds of
+# them. A mockup doesn't need kerning to the unit, so the values can be
+# rounded to a grid, or gathered into a few clusters, at the cost of a little
+# error in the width of each kerned pair.
+
+from collections import Counter
+
+
+def round_to_grid(value, grid):
+    return int(grid * round(value / grid))
+
+
+# One-dimensional k-means, weighted by how many pairs use each value. Each
+# cluster is a run of neighbouring values, so we only need to move the
+# boundaries between them until they settle. We start from evenly spaced
+# quantiles, which means the busy parts of the range get more clusters.
+def cluster(counts, buckets):
+    values = sorted(counts)
+    if len(values) <= buckets:
+        return {v: v for v in values}
+
+    total = sum(counts.values())
+    centres = []
+    seen = 0
+    target = 0
+    for v in values:
+        seen += counts[v]
+        while len(centres) < buckets and seen > (target + 0.5) * total / buckets:
+            if not centres or centres[-1] != v:
+                centres.append(v)
+            target += 1
+
+    for _ in range(100):
+        groups = nearest(values, centres)
+        new_centres = [
+            round(sum(v * counts[v] for v in group) / sum(counts[v] for v in group))
+            for group in groups.values()
+        ]
+        if new_centres == centres:
+            break
+        centres = new_centres
+
+    return {
+        v: centre for centre, group in nearest(values, centres).items() for v in group
+    }
+
+
+# Splits sorted values into runs by which of the sorted centres they are
+# closest to.
+def nearest(values, centres):
+    groups = {}
+    i = 0
+    for v in values:
+        while i + 1 < len(centres) and abs(centres[i + 1] - v) < abs(centres[i] - v):
+            i += 1
+        groups.setdefault(centres[i], []).append(v)
+    return groups
+
+
+# Works out what each kern value becomes: rounded to a multiple of grid,
+# then clustered into at most buckets different values. Either can be None.
+def kern_value_map(values, grid=None, buckets=None):
+    counts = Counter(values)
+    mapping = {v: v for v in counts}
+    if grid is not None:
+        mapping = {v: round_to_grid(v, grid) for v in counts}
+    if buckets is not None:
+        rounded = Counter()
+        for v, count in counts.items():
+            rounded[mapping[v]] += count
+        centres = cluster(rounded, buckets)
+        mapping = {v: centres[mapping[v]] for v in counts}
+    return mapping
@@ -0,0 +1,238 @@
+# This part of the code is all about guessing how big our lookups will be
+# once they are compiled, without going to the trouble of compiling them.
+# All the sizes are in bytes, and err on the large side.
+
+# Subtables are found through 16-bit offsets from the start of their lookup,
+# so everything in a lookup has to fit into 64K. We stop a little short of
+# that because these are only estimates.
+LOOKUP_SIZE_LIMIT = 0xF000
+
+# What a lookup costs on top of its subtables: its offset in the lookup list
+# and its index in the feature.
+NEW_LOOKUP_SIZE = 4
+
+# Once GSUB is bigger than 64K, the lookups can't all be reached through
+# 16-bit offsets, so the compiler turns them into extension lookups, which
+# put a small table with a 32-bit offset in front of every subtable.
+EXTENSION_SUBTABLE_SIZE = 8
+
+
+# Coverage format 1 is a list of glyph IDs; format 2 (ranges) only gets used
+# when it is smaller than that.
+def coverage_size(glyph_count):
+    return 4 + 2 * glyph_count
+
+
+# Class definitions are either a run of classes for every glyph from the
+# first to the last, or a list of ranges. We don't know where the glyphs are
+# in the glyph order, so we take the worst case: a range for every glyph.
+def class_def_size(glyph_count):
+    return 4 + 6 * glyph_count
+
+
+def lookup_header_size(subtables):
+    return 6 + 2 * subtables + 2
+
+
+# A format 3 chaining subtable: one coverage table per glyph position.
+def chain_rule_size(precontext, input_, postcontext, lookups=1):
+    size = 10 + 4 * lookups
+    for position in precontext + input_ + postcontext:
+        size += 2 + coverage_size(len(position))
+    return size
+
+
+# A format 2 single substitution: one substitute per glyph covered.
+def single_subst_size(glyph_count):
+    return 6 + 2 * glyph_count + coverage_size(glyph_count)
+
+
+# A multiple substitution: one sequence of glyphs per glyph covered.
+def multiple_subst_size(sequence_lengths):
+    count = len(sequence_lengths)
+    sequences = sum(2 + 2 * n for n in sequence_lengths)
+    return 6 + 2 * count + coverage_size(count) + sequences
+
+
+# Everything in GSUB apart from the lookups themselves: the header, one
+# script with its default language, the features and the lookup list.
+def gsub_header_size(lookups, features=1):
+    script_list = 14 + 6 + 2 * features
+    feature_list = 2 + 12 * features + 2 * lookups
+    return 10 + script_list + feature_list + 2 + 2 * lookups
+
+
+# Keeps a running total of the size of a chaining lookup as kerning rules
+# are added to it. feaLib and otlLib try to compile the lookup as a single
+# format 1 subtable (only possible when every rule is glyph-to-glyph), a
+# single format 2 subtable (only possible when the classes on each side never
+# overlap without being the same), and as one format 3 subtable per rule,
+# and keep whichever is smallest. A format 1 or 2 subtable has to fit into
+# 64K, so when it gets too big everything falls back to format 3, which is
+# far bigger. Identical tables are only written once, so we count each
+# coverage table and each rule (which is its right side and the lookup it
+# calls) once.
+class ChainingLookupSize:
+    def __init__(self):
+        self.rules = 0
+        self.single = True
+        self.class_based = True
+        self.first_glyphs = set()
+        self.glyph_rules = set()
+        self.left_classes = {}
+        self.left_class_count = 0
+        self.right_classes = {}
+        self.class_rules = set()
+        self.coverages = set()
+        self.coverages_size = 0
+
+    # Can this side of a rule go into a class definition which already has
+    # these classes in it?
+    @staticmethod
+    def _fits(classes, side):
+        if classes.get(side[0]) == side:
+            return True
+        return not any(g in classes for g in side)
+
+    def _sizes(
+        self,
+        rules,
+        single,
+        class_based,
+        first,
+        glyph_rules,
+        left_classes,
+        left_glyphs,
+        right_glyphs,
+        class_rules,
+        coverages_size,
+    ):
+        sizes = {}
+        if single:
+            sizes[1] = (
+                6
+                + 2 * first
+                + coverage_size(first)
+                + 2 * first
+                + 2 * rules
+                + 14 * glyph_rules
+            )
+        if class_based:
+            sizes[2] = (
+                14
+                + 2 * left_classes
+                + coverage_size(left_glyphs)
+                + class_def_size(0)
+                + class_def_size(left_glyphs)
+                + class_def_size(right_glyphs)
+                + 2 * left_classes
+                + 2 * rules
+                + 14 * class_rules
+            )
+        sizes[3] = 18 * rules + coverages_size
+        return sizes
+
+    # The compiled size of each format the lookup could be built in, for the
+    # rules so far plus any given here.
+    def formats(self, left=None, right=None, lookup=None):
+        rules = self.rules
+        single, class_based = self.single, self.class_based
+        first = len(self.first_glyphs)
+        glyph_rules, class_rules = len(self.glyph_rules), len(self.class_rules)
+        left_classes = self.left_class_count
+        left_glyphs, right_glyphs = len(self.left_classes), len(self.right_classes)
+        coverages_size = self.coverages_size
+        if left is not None:
+            left, right = tuple(sorted(left)), tuple(sorted(right))
+            rules += 1
+            single = single and len(left) == 1 and len(right) == 1
+            if single:
+                first += left[0] not in self.first_glyphs
+                glyph_rules += (right[0], lookup) not in self.glyph_rules
+            class_based = (
+                class_based
+                and self._fits(self.left_classes, left)
+                and self._fits(self.right_classes, right)
+            )
+            if class_based:
+                new_left = left[0] not in self.left_classes
+                left_classes += new_left
+                left_glyphs += len(left) if new_left else 0
+                right_glyphs += 0 if right[0] in self.right_classes else len(right)
+                class_rules += (right, lookup) not in self.class_rules
+            for side in (left, right):
+                if side not in self.coverages:
+                    coverages_size += coverage_size(len(side))
+        sizes = self._sizes(
+            rules,
+            single,
+            class_based,
+            first,
+            glyph_rules,
+            left_classes,
+            left_glyphs,
+            right_glyphs,
+            class_rules,
+            coverages_size,
+        )
+        return {
+            number: lookup_header_size(rules if number == 3 else 1) + size
+            for number, size in sizes.items()
+            if number == 3 or size <= LOOKUP_SIZE_LIMIT
+        }
+
+    # The format the lookup will be built in, and its size
+    def best(self, left=None, right=None, lookup=None):
+        if not self.rules and left is None:
+            return None, 0
+        formats = self.formats(left, right, lookup)
+        number = min(formats, key=formats.get)
+        return number, formats[number]
+
+    def format(self):
+        return self.best()[0]
+
+    def size(self):
+        return self.best()[1]
+
+    def subtables(self):
+        return self.rules if self.format() == 3 else min(self.rules, 1)
+
+    def add(self, left, right, lookup=None):
+        left, right = tuple(sorted(left)), tuple(sorted(right))
+        self.rules += 1
+        if self.single and len(left) == 1 and len(right) == 1:
+            self.first_glyphs.add(left[0])
+            self.glyph_rules.add((right[0], lookup))
+        else:
+            self.single = False
+        if (
+            self.class_based
+            and self._fits(self.left_classes, left)
+            and self._fits(self.right_classes, right)
+        ):
+            self.left_class_count += left[0] not in self.left_classes
+            self.left_classes.update((g, left) for g in left)
+            self.right_classes.update((g, right) for g in right)
+            self.class_rules.add((right, lookup))
+        else:
+            self.class_based = False
+        for side in (left, right):
+            if side not in self.coverages:
+                self.coverages.add(side)
+                self.coverages_size += coverage_size(len(side))
+
+    # Should this rule go into a new lookup instead? It should if the lookup
+    # would go over the limit, or if the rule would cost more here than it
+    # would on its own in a new lookup; that happens when it can't go into
+    # the lookup's format 1 or 2 subtable. A lookup always gets at least one
+    # rule, however big it is.
+    def would_overflow(self, left, right, lookup=None):
+        if not self.rules:
+            return False
+        size = self.size()
+        size_with = self.best(left, right, lookup)[1]
+        if size_with > LOOKUP_SIZE_LIMIT:
+            return True
+        on_its_own = ChainingLookupSize().best(left, right, lookup)[1]
+        return size_with - size > on_its_own + NEW_LOOKUP_SIZE
@@ -0,0 +1,54 @@
+# This part of the code keeps track of where the time goes when we build a
+# flow font, and how big the things we build are.
+
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class Stats:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = []
+        self.counts = {}
+
+    # Time a stage of the build. Peak memory comes from tracemalloc, which
+    # slows everything down quite a bit, so it is only switched on when
+    # statistics have been asked for.
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self.stages.append(
+                {
+                    "stage": name,
+                    "seconds": round(seconds, 4),
+                    "peak_memory": max(peak - memory_before, 0),
+                }
+            )
+
+    def count(self, name, value):
+        if self.enabled:
+            self.counts[name] = value
+
+    def as_dict(self):
+        return {"stages": self.stages, "counts": self.counts}
+
+    def as_json(self):
+        return json.dumps(self.as_dict(), indent=2)
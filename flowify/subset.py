@@ -0,0 +1,157 @@
+# This part of the code is all about flowifying just part of a font: the
+# glyphs for some Unicode ranges or scripts, along with everything the font's
+# own substitutions can turn them into. Everything else is dropped, so that a
+# flow font for a Latin-only mockup doesn't have to carry the whole of a
+# multi-script family around with it.
+
+import logging
+import re
+
+from fontTools import unicodedata
+from fontTools.feaLib.builder import Builder
+from fontTools.feaLib.error import FeatureLibError
+from fontTools.subset import Options, Subsetter, parse_unicodes
+from fontTools.ttLib import TTFont, newTable
+from fontTools.ttLib.tables._c_m_a_p import cmap_format_12
+from ufo2ft.featureCompiler import parseLayoutFeatures
+from ufoLib2.objects import Glyph
+
+logger = logging.getLogger(__name__)
+
+SCRIPT_CODE = re.compile(r"^[A-Z][a-z]{3}$")
+
+# Spaces, digits, punctuation and combining marks are shared by every
+# script, so they come along with whichever scripts are asked for.
+SHARED_SCRIPTS = {"Zyyy", "Zinh"}
+
+
+# A subset is given as a comma-separated list of Unicode ranges
+# (U+0000-007F, or just 0-7F) and ISO 15924 script codes (Latn, Grek).
+def parse_subset(spec):
+    codepoints = set()
+    scripts = set()
+    for token in spec.replace(" ", "").split(","):
+        if not token:
+            continue
+        if SCRIPT_CODE.match(token):
+            try:
+                unicodedata.script_name(token)
+            except KeyError:
+                raise ValueError("Unknown script %r in subset" % token)
+            scripts.add(token)
+            continue
+        try:
+            codepoints.update(parse_unicodes(token))
+        except ValueError:
+            raise ValueError(
+                "Can't understand %r in subset; expected a Unicode range "
+                "like U+0000-007F or a script code like Latn" % token
+            )
+    if not codepoints and not scripts:
+        raise ValueError("The subset %r is empty" % spec)
+    return codepoints, scripts
+
+
+# Which of the codepoints in a font are in the subset
+def wanted_unicodes(available, spec):
+    codepoints, scripts = parse_subset(spec)
+    if scripts:
+        scripts = scripts | SHARED_SCRIPTS
+    return {
+        u
+        for u in available
+        if u in codepoints
+        or (scripts and unicodedata.script_extension(chr(u)) & scripts)
+    }
+
+
+def closure_options():
+    options = Options()
+    options.layout_features = ["*"]
+    return options
+
+
+# The glyphs of a UFO which are needed for the subset: the ones mapped to
+# its codepoints, anything the font's substitutions can turn those into, and
+# the glyphs used as components by any of them. To follow the substitutions
+# we compile just the GSUB table of the font's feature code into an
+# otherwise empty font.
+def glyph_closure(font, spec):
+    cmap = {u: glyph.name for glyph in font for u in glyph.unicodes}
+    unicodes = wanted_unicodes(cmap, spec)
+    ttfont = TTFont()
+    ttfont.setGlyphOrder([glyph.name for glyph in font])
+    ttfont["cmap"] = newTable("cmap")
+    ttfont["cmap"].tableVersion = 0
+    subtable = cmap_format_12(12)
+    subtable.platformID, subtable.platEncID, subtable.language = 3, 10, 0
+    subtable.cmap = cmap
+    ttfont["cmap"].tables = [subtable]
+    try:
+        Builder(ttfont, parseLayoutFeatures(font)).build(tables={"GSUB"})
+    except FeatureLibError as e:
+        logger.warning(
+            "Couldn't compile the font's substitutions, so only glyphs in the "
+            "subset's codepoints are kept: %s",
+            e,
+        )
+
+    subsetter = Subsetter(closure_options())
+    subsetter.populate(unicodes=unicodes)
+    subsetter.subset(ttfont)
+    glyphs = set(ttfont.getGlyphOrder())
+
+    pending = list(glyphs)
+    while pending:
+        for component in font[pending.pop()].components:
+            if component.baseGlyph in font and component.baseGlyph not in glyphs:
+                glyphs.add(component.baseGlyph)
+                pending.append(component.baseGlyph)
+    return glyphs
+
+
+# A UFO's feature code can still refer to the glyphs we don't want, so they
+# stay in the font but are swapped for empty glyphs of the same width with no
+# codepoints, and any kerning which only involves them goes. (The glyphs are
+# replaced rather than changed, as watch mode shares them with its copy of
+# the source font.)
+def drop_glyphs(font, keep):
+    layer = font.layers.defaultLayer
+    for glyph in list(font):
+        if glyph.name not in keep:
+            layer.insertGlyph(
+                Glyph(glyph.name, width=glyph.width, height=glyph.height),
+                overwrite=True,
+                copy=False,
+            )
+
+    for name, members in list(font.groups.items()):
+        if name.startswith("public.kern"):
+            members = [g for g in members if g in keep]
+            if members:
+                font.groups[name] = members
+            else:
+                del font.groups[name]
+    for pair in list(font.kerning.keys()):
+        if not all(side in keep or side in font.groups for side in pair):
+            del font.kerning[pair]
+
+
+# A compiled font can really lose the glyphs, with everything that refers to
+# them. Keeps either the glyphs given, or the subset given by a spec.
+def subset_binary(ttfont, keep=None, spec=None):
+    options = closure_options()
+    options.name_IDs = ["*"]
+    options.name_languages = ["*"]
+    options.name_legacy = True
+    options.notdef_outline = True
+    options.glyph_names = True
+    options.legacy_kern = True
+    options.hinting = True
+    options.prune_unicode_ranges = False
+    subsetter = Subsetter(options)
+    if spec is not None:
+        subsetter.populate(unicodes=wanted_unicodes(ttfont.getBestCmap(), spec))
+    else:
+        subsetter.populate(glyphs=keep)
+    subsetter.subset(ttfont)
@@ -0,0 +1,167 @@
+# This part of the code is all about checking that a flow font really does
+# take up the same space as the font it came from. We shape every line of a
+# corpus with both fonts and compare the total advances; when a line doesn't
+# match, each word in it is shaped on its own to find the culprits. The
+# corpus is read a chunk at a time and the chunks are shaped in worker
+# processes, so even a very large corpus doesn't have to fit in memory or
+# wait on a single core.
+#
+#   flowify-verify Font.ttf FontFlow.ttf corpus.txt --workers 8
+#
+# Needs uharfbuzz, which flowify itself doesn't.
+import argparse
+import collections
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+parser = argparse.ArgumentParser(
+    prog="flowify-verify",
+    description="Check that a flow font has the same advance widths as the original.",
+)
+parser.add_argument("original", help="The original font (TTF or OTF)")
+parser.add_argument("flow", help="The flow font made from it (TTF or OTF)")
+parser.add_argument(
+    "corpus", help="Text file to check, one line of text per line ('-' for stdin)"
+)
+parser.add_argument(
+    "--workers",
+    default=os.cpu_count() or 1,
+    type=int,
+    help="Number of worker processes (default: one per CPU)",
+)
+parser.add_argument(
+    "--chunk-size", default=500, type=int, help="Lines of the corpus sent to a worker at once"
+)
+parser.add_argument(
+    "--max-reports",
+    default=100,
+    type=int,
+    help="Most mismatching lines to print (all of them are counted)",
+)
+
+# Each worker process loads the two fonts once, and keeps them here
+_fonts = None
+
+
+def _hb():
+    try:
+        import uharfbuzz
+    except ImportError:
+        raise SystemExit("Checking flow fonts needs uharfbuzz: pip install uharfbuzz")
+    return uharfbuzz
+
+
+def load_fonts(original, flow):
+    global _fonts
+    hb = _hb()
+    _fonts = []
+    for path in [original, flow]:
+        with open(path, "rb") as f:
+            _fonts.append(hb.Font(hb.Face(f.read())))
+
+
+def shape(font, text):
+    hb = _hb()
+    buf = hb.Buffer()
+    buf.add_str(text)
+    buf.guess_segment_properties()
+    hb.shape(font, buf)
+    return (
+        sum(pos.x_advance for pos in buf.glyph_positions),
+        [font.glyph_to_string(info.codepoint) for info in buf.glyph_infos],
+    )
+
+
+# Shape a chunk of (line number, text) pairs with both fonts, and return the
+# lines which don't match, along with the words in them which don't.
+def check_chunk(lines):
+    original, flow = _fonts
+    mismatches = []
+    for number, text in lines:
+        want = shape(original, text)[0]
+        got = shape(flow, text)[0]
+        if want == got:
+            continue
+        words = []
+        for word in text.split():
+            word_want, original_glyphs = shape(original, word)
+            word_got, flow_glyphs = shape(flow, word)
+            if word_want != word_got:
+                words.append((word, word_want, word_got, original_glyphs, flow_glyphs))
+        mismatches.append((number, text, want, got, words))
+    return len(lines), mismatches
+
+
+def chunks(stream, size):
+    chunk = []
+    for number, line in enumerate(stream, 1):
+        chunk.append((number, line.rstrip("\r\n")))
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def report(mismatch):
+    number, text, want, got, words = mismatch
+    print("line %i: original %i, flow %i (%+i)" % (number, want, got, got - want))
+    print("    %s" % text)
+    for word, word_want, word_got, original_glyphs, flow_glyphs in words:
+        print("    word %r: original %i, flow %i" % (word, word_want, word_got))
+        print("        original glyphs: %s" % " ".join(original_glyphs))
+        print("        flow glyphs: %s" % " ".join(flow_glyphs))
+    if not words:
+        print("    (every word matches on its own)")
+
+
+# Results come back in the order the chunks went out, and only a few chunks
+# per worker are in flight at once, so the corpus is read as it is needed.
+def check_corpus(args, stream):
+    checked = 0
+    mismatches = 0
+    with ProcessPoolExecutor(
+        max_workers=max(args.workers, 1),
+        initializer=load_fonts,
+        initargs=(args.original, args.flow),
+    ) as executor:
+        pending = collections.deque()
+        for chunk in chunks(stream, max(args.chunk_size, 1)):
+            pending.append(executor.submit(check_chunk, chunk))
+            while len(pending) > 2 * max(args.workers, 1):
+                checked, mismatches = collect(args, pending, checked, mismatches)
+        while pending:
+            checked, mismatches = collect(args, pending, checked, mismatches)
+    return checked, mismatches
+
+
+def collect(args, pending, checked, mismatches):
+    lines, found = pending.popleft().result()
+    for mismatch in found:
+        mismatches += 1
+        if mismatches <= args.max_reports:
+            report(mismatch)
+    return checked + lines, mismatches
+
+
+def main(args=None):
+    args = parser.parse_args(args)
+    _hb()
+    start = time.perf_counter()
+    if args.corpus == "-":
+        checked, mismatches = check_corpus(args, sys.stdin)
+    else:
+        with open(args.corpus, encoding="utf-8") as stream:
+            checked, mismatches = check_corpus(args, stream)
+    print(
+        "%i lines checked, %i mismatches (%.2fs)"
+        % (checked, mismatches, time.perf_counter() - start),
+        file=sys.stderr,
+    )
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
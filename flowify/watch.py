@@ -0,0 +1,253 @@
+# This part of the code is all about watch mode: keeping a flow font up to
+# date while a designer works on the UFO it comes from. Rather than starting
+# from scratch every time, we keep the source font in memory and only read
+# back the files which changed. The slug glyphs and arithmetic routines are
+# kept in a family cache, the kerning routines are reused until the kerning
+# changes, and only the files of the output UFO which changed are written.
+
+import logging
+import os
+import time
+
+from fontTools.ufoLib import UFOReader, UFOWriter
+from ufoLib2 import Font
+from ufoLib2.objects import Layer
+
+import flowify.cache
+from flowify import Flowify, _copy_routines, _stand_in_font
+
+logger = logging.getLogger(__name__)
+
+# Files in the UFO which we can read back on their own. A change to anything
+# else (fontinfo.plist, lib.plist, contents.plist, other layers...) means
+# opening the whole font again.
+GLYPHS_DIRECTORY = "glyphs"
+PARTIAL_FILES = ["kerning.plist", "groups.plist", "features.fea"]
+
+
+# A Flowify which can pick up the kerning routines from the previous build,
+# if nothing they depend on has changed since then.
+class IncrementalFlowify(Flowify):
+    def __init__(self, font, previous=None, output_path=None, **kwargs):
+        self.previous = previous
+        self.output_path = output_path
+        try:
+            super().__init__(font, **kwargs)
+        finally:
+            self.previous = None
+
+    # The font we work on has no path of its own, so a separate feature file
+    # is included relative to the UFO we write.
+    def fea_include(self):
+        return os.path.relpath(
+            os.path.abspath(self.fea_path),
+            os.path.dirname(os.path.abspath(self.output_path)),
+        )
+
+    def make_kerning_routines(self):
+        self.kerning_inputs = (
+            self.family_key,
+            dict(self.font.kerning),
+            {k: list(v) for k, v in self.font.groups.items()},
+            self.relevant_glyph_set,
+        )
+        previous = self.previous
+        if getattr(previous, "kerning_inputs", None) == self.kerning_inputs:
+            logger.info("Kerning hasn't changed; reusing the kerning routines")
+            template, classes = previous.kerning_template
+            self.kern_rules = previous.kern_rules
+            self.kern_values = previous.kern_values
+            self.kern_errors = previous.kern_errors
+            self.ff.namedClasses.update(classes)
+            self.kerning_template = previous.kerning_template
+            return _copy_routines(template)
+
+        routines = super().make_kerning_routines()
+        classes = {
+            name: list(glyphs)
+            for name, glyphs in self.ff.namedClasses.items()
+            if name.startswith("flow_kern")
+        }
+        # Writing the feature code changes the routines, so we keep a copy
+        self.kerning_template = (_copy_routines(routines), classes)
+        return routines
+
+
+class Watcher:
+    def __init__(self, input_path, output_path, interval=1.0, **options):
+        if options.get("output", "fea") != "fea":
+            raise ValueError("Watch mode writes a UFO, so it can't make binary fonts")
+        self.input_path = input_path
+        self.output_path = output_path
+        self.interval = interval
+        self.options = options
+        self.family_cache = {}
+        self.flowify = None
+        self.pending = set()
+        self.load()
+        self.build()
+        self.save()
+
+    # Modification times of every file in the source UFO, by path relative
+    # to the UFO
+    def scan(self):
+        mtimes = {}
+        for directory, _, files in os.walk(self.input_path):
+            for name in files:
+                path = os.path.join(directory, name)
+                try:
+                    mtimes[os.path.relpath(path, self.input_path)] = os.stat(path).st_mtime_ns
+                except OSError:
+                    pass
+        return mtimes
+
+    def load(self):
+        self.snapshot = self.scan()
+        self.source = Font.open(self.input_path, lazy=False)
+
+    # The font Flowify works on: the source glyphs go in as they are, and
+    # everything else is copied.
+    def working_font(self):
+        return _stand_in_font(self.source)
+
+    def build(self):
+        start = time.perf_counter()
+        self.font = self.working_font()
+        self.flowify = IncrementalFlowify(
+            self.font,
+            previous=self.flowify,
+            output_path=self.output_path,
+            family_cache=self.family_cache,
+            **self.options
+        )
+        self.added_glyph_data = {
+            g: flowify.cache.glyph_to_data(self.font[g])
+            for g in self.flowify.added_glyphs
+        }
+        logger.info("Built %s in %.2fs", self.output_path, time.perf_counter() - start)
+
+    def save(self):
+        self.font.save(self.output_path, overwrite=True)
+        self.written = self.written_state()
+
+    # Everything in the output UFO apart from the glyphs, as it was last written
+    def written_state(self):
+        return {
+            "features": self.font.features.text,
+            "kerning": dict(self.font.kerning),
+            "groups": {k: list(v) for k, v in self.font.groups.items()},
+        }
+
+    # Look for changes. We only rebuild once the files have stopped changing
+    # for one interval, so that we don't read a font which is half saved.
+    def poll(self):
+        snapshot = self.scan()
+        if snapshot != self.snapshot:
+            self.pending.update(
+                path
+                for path in set(snapshot) | set(self.snapshot)
+                if snapshot.get(path) != self.snapshot.get(path)
+            )
+            self.snapshot = snapshot
+            return False
+        if not self.pending:
+            return False
+        changed, self.pending = self.pending, set()
+        self.update(changed)
+        return True
+
+    def update(self, changed):
+        glifs = [
+            path
+            for path in changed
+            if os.path.dirname(path) == GLYPHS_DIRECTORY and path.endswith(".glif")
+        ]
+        others = [path for path in changed if path not in glifs]
+        if any(path not in PARTIAL_FILES for path in others):
+            logger.info("Reopening %s", self.input_path)
+            self.load()
+            self.build()
+            self.save()
+            return
+
+        old_font = self.font
+        reader = UFOReader(self.input_path, validate=False)
+        reloaded = self.reload_glyphs(reader, glifs)
+        if reloaded is None:
+            logger.info("Glyphs were added or removed; reopening %s", self.input_path)
+            self.load()
+            self.build()
+            self.save()
+            return
+        if "kerning.plist" in others:
+            self.source.kerning = reader.readKerning()
+        if "groups.plist" in others:
+            self.source.groups = reader.readGroups()
+        if "features.fea" in others:
+            self.source.features.text = reader.readFeatures()
+        self.build()
+        self.save_changes(old_font, reloaded)
+
+    # Read back the glyphs whose files changed, or return None if the set of
+    # glyphs itself has changed.
+    def reload_glyphs(self, reader, glifs):
+        if not glifs:
+            return []
+        glyph_set = reader.getGlyphSet()
+        names = {filename: name for name, filename in glyph_set.contents.items()}
+        layer = Layer.read(self.source.layers.defaultLayer.name, glyph_set)
+        reloaded = []
+        for path in glifs:
+            name = names.get(os.path.basename(path))
+            if name is None or name not in self.source:
+                return None
+            self.source.layers.defaultLayer.insertGlyph(layer[name], copy=False)
+            reloaded.append(name)
+        return reloaded
+
+    # Write only the files of the output UFO which have changed
+    def save_changes(self, old_font, reloaded):
+        written = self.written_state()
+        writer = UFOWriter(self.output_path, validate=False)
+        glyph_set = writer.getGlyphSet()
+        changed = set(reloaded)
+        for name, data in self.added_glyph_data.items():
+            if name not in old_font or flowify.cache.glyph_to_data(old_font[name]) != data:
+                changed.add(name)
+        removed = [name for name in old_font.keys() if name not in self.font]
+        for name in sorted(changed):
+            glyph = self.font[name]
+            glyph_set.writeGlyph(name, glyph, glyph.drawPoints)
+        for name in removed:
+            glyph_set.deleteGlyph(name)
+        if changed or removed:
+            glyph_set.writeContents()
+        features_changed = written["features"] != self.written["features"]
+        if features_changed:
+            writer.writeFeatures(written["features"])
+        if written["kerning"] != self.written["kerning"]:
+            writer.writeKerning(written["kerning"])
+        if written["groups"] != self.written["groups"]:
+            writer.writeGroups(written["groups"])
+        writer.close()
+        self.written = written
+        logger.info(
+            "Wrote %i glyphs%s to %s",
+            len(changed),
+            " and the features" if features_changed else "",
+            self.output_path,
+        )
+
+    def run(self):
+        logger.info("Watching %s for changes", self.input_path)
+        try:
+            while True:
+                time.sleep(self.interval)
+                try:
+                    self.poll()
+                except Exception as e:
+                    # A font in the middle of being edited may not make sense;
+                    # say so and wait for the next change.
+                    logger.error("Couldn't update %s: %s", self.output_path, e)
+        except KeyboardInterrupt:
+            pass
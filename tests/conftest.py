@@ -0,0 +1,92 @@
+import io
+import random
+
+import pytest
+from ufoLib2 import Font
+from ufoLib2.objects import Glyph
+
+
+# A small font with a combining mark, a pair of kerning groups, and kerning
+# between random pairs of glyphs on top.
+def build_font(glyphs=30, kern_pairs=40, seed=1):
+    rng = random.Random(seed)
+    font = Font()
+    font.info.familyName = "Test"
+    font.info.styleName = "Regular"
+    font.info.unitsPerEm = 1000
+    font.info.xHeight = 500
+    font.info.capHeight = 700
+    font.info.ascender = 800
+    font.info.descender = -200
+    font.addGlyph(Glyph(".notdef", width=500))
+    font.addGlyph(Glyph("space", width=250, unicodes=[0x20]))
+    font.addGlyph(Glyph("acutecomb", width=0, unicodes=[0x301]))
+    font.lib["public.openTypeCategories"] = {"acutecomb": "mark"}
+    names = []
+    for i in range(glyphs):
+        glyph = Glyph("g%i" % i, width=rng.randint(100, 800), unicodes=[0x61 + i])
+        pen = glyph.getPen()
+        pen.moveTo((0, 0))
+        pen.lineTo((glyph.width, 0))
+        pen.lineTo((glyph.width, 500))
+        pen.closePath()
+        font.addGlyph(glyph)
+        names.append(glyph.name)
+    font.groups["public.kern1.L"] = names[:4]
+    font.groups["public.kern2.R"] = names[4:8]
+    font.kerning[("public.kern1.L", "public.kern2.R")] = -40
+    while len(font.kerning) < kern_pairs + 1:
+        left, right = rng.sample(names[8:], 2)
+        font.kerning[(left, right)] = rng.choice([-50, -20, -10, 10, 15, 30])
+    return font
+
+
+def build_corpus(font, texts=200, seed=5):
+    rng = random.Random(seed)
+    chars = [chr(g.unicodes[0]) for g in font if g.unicodes and g.width]
+    chars.remove(" ")
+    return [
+        " ".join(
+            "".join(rng.choice(chars) for _ in range(rng.randint(1, 8)))
+            + ("\u0301" if rng.random() < 0.1 else "")
+            for _ in range(rng.randint(1, 4))
+        )
+        for _ in range(texts)
+    ]
+
+
+@pytest.fixture
+def make_font():
+    return build_font
+
+
+@pytest.fixture
+def corpus():
+    return build_corpus
+
+
+# Shapes text with a compiled font, and gives back the glyph names and the
+# total advance width.
+@pytest.fixture
+def shaper():
+    hb = pytest.importorskip("uharfbuzz")
+
+    def make(ttfont):
+        data = io.BytesIO()
+        ttfont.save(data)
+        hbfont = hb.Font(hb.Face(data.getvalue()))
+        order = ttfont.getGlyphOrder()
+
+        def shape(text):
+            buf = hb.Buffer()
+            buf.add_str(text)
+            buf.guess_segment_properties()
+            hb.shape(hbfont, buf)
+            return (
+                [order[info.codepoint] for info in buf.glyph_infos],
+                sum(pos.x_advance for pos in buf.glyph_positions),
+            )
+
+        return shape
+
+    return make
@@ -0,0 +1,30 @@
+import pytest
+from ufo2ft import compileTTF
+
+from flowify import Flowify
+
+
+# A smaller adder must still add up every word to its real width, right up to
+# a word of max_word_length of the widest glyph, kerned as loosely as the font
+# ever kerns.
+@pytest.mark.parametrize("max_word_length", [8, 20])
+@pytest.mark.parametrize("options", [{}, {"encoding": "width"}, {"no_blank": True}])
+def test_auto_arithmetic_keeps_widths(
+    make_font, corpus, shaper, max_word_length, options
+):
+    def build():
+        font = make_font()
+        widest = max((g for g in font if g.name.startswith("g")), key=lambda g: g.width)
+        font.kerning[(widest.name, widest.name)] = max(font.kerning.values())
+        return font, chr(widest.unicodes[0]) * max_word_length
+
+    font, longest = build()
+    texts = corpus(font) + [longest]
+    original = shaper(compileTTF(build()[0]))
+    flowify = Flowify(
+        font, arithmetic="auto", max_word_length=max_word_length, **options
+    )
+    assert (flowify.PLACES, flowify.BASE) != (7, 4)
+    flow = shaper(compileTTF(font))
+    for text in texts:
+        assert flow(text)[1] == original(text)[1], text
@@ -0,0 +1,52 @@
+import io
+
+import pytest
+from fontTools.ttLib import TTFont
+from ufo2ft import compileTTF
+
+from flowify import Flowify
+
+
+def flow_font(font, **options):
+    flowify = Flowify(font, **options)
+    ttfont = compileTTF(font)
+    if options.get("output") == "binary":
+        flowify.add_to_binary_font(ttfont)
+    data = io.BytesIO()
+    ttfont.save(data)
+    data.seek(0)
+    return TTFont(data)
+
+
+# Binary output should do exactly what the feature code does.
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"kerning": "classes"}, {"shape": "rectangle"}, {"pipeline": "fused"}],
+)
+def test_binary_output_matches_feature_code(make_font, corpus, shaper, options):
+    texts = corpus(make_font())
+    original = shaper(compileTTF(make_font()))
+    fea = shaper(flow_font(make_font(), **options))
+    binary = shaper(flow_font(make_font(), output="binary", **options))
+    for text in texts:
+        assert binary(text) == fea(text), text
+        assert binary(text)[1] == original(text)[1], text
+
+
+# With no marks in the font, delete_marks has nothing to delete and mustn't
+# turn into a null lookup.
+def test_no_empty_lookups(make_font, corpus, shaper):
+    font = make_font()
+    del font["acutecomb"]
+    font.lib["public.openTypeCategories"] = {}
+    ttfont = flow_font(font, output="binary")
+    lookups = ttfont["GSUB"].table.LookupList.Lookup
+    assert None not in lookups
+    for feature in ttfont["GSUB"].table.FeatureList.FeatureRecord:
+        assert all(ix < len(lookups) for ix in feature.Feature.LookupListIndex)
+
+    original = shaper(compileTTF(make_font()))
+    flow = shaper(ttfont)
+    for text in corpus(font):
+        text = text.replace("\u0301", "")
+        assert flow(text)[1] == original(text)[1], text
@@ -0,0 +1,70 @@
+import os
+import pickle
+
+import pytest
+from ufoLib2.objects import Component
+
+from flowify import Flowify
+from flowify.cache import DiskCache
+
+
+# A flow font restored from the cache should look just like one which was
+# built, to estimate() and slug_layout() as much as to the font.
+@pytest.mark.parametrize("output", ["fea", "binary"])
+@pytest.mark.parametrize("kerning", ["pairs", "classes"])
+def test_cache_hit_restores_everything(make_font, tmp_path, output, kerning):
+    pytest.importorskip("numpy")
+    options = dict(
+        output=output, kerning=kerning, cache_dir=str(tmp_path), stats=True
+    )
+    built = Flowify(make_font(), **options)
+    restored = Flowify(make_font(), **options)
+    assert restored.stats.counts.get("cache_hit") == 1
+    assert restored.estimate() == built.estimate()
+    assert restored.slug_layout().as_dict() == built.slug_layout().as_dict()
+    if output == "fea":
+        assert restored.font.features.text == built.font.features.text
+
+
+# The subset closure follows the font's own substitutions, so changing them
+# has to miss the cache.
+def test_feature_code_is_in_the_key(make_font, tmp_path):
+    options = dict(subset="U+61-62", cache_dir=str(tmp_path), stats=True)
+    font = make_font()
+    font.features.text = "feature liga { sub g0 g1 by g20; } liga;"
+    Flowify(font, **options)
+    font = make_font()
+    font.features.text = "feature liga { sub g0 g1 by g21; } liga;"
+    flowify = Flowify(font, **options)
+    assert "cache_hit" not in flowify.stats.counts
+    assert "g21" in flowify.relevant_glyphs
+
+
+# The closure follows components too.
+def test_components_are_in_the_key(make_font, tmp_path):
+    options = dict(subset="U+61-62", cache_dir=str(tmp_path), stats=True)
+    font = make_font()
+    font["g0"].components.append(Component("g20"))
+    Flowify(font, **options)
+    font = make_font()
+    font["g0"].components.append(Component("g21"))
+    flowify = Flowify(font, **options)
+    assert "cache_hit" not in flowify.stats.counts
+    assert "g21" in flowify.relevant_glyphs
+
+
+# An entry mustn't be able to run code when it's read back.
+def test_cache_refuses_other_classes(tmp_path):
+    cache = DiskCache(str(tmp_path))
+    with open(os.path.join(str(tmp_path), "evil.pickle"), "wb") as f:
+        pickle.dump(Evil(str(tmp_path / "pwned")), f)
+    assert cache.get("evil") is None
+    assert not (tmp_path / "pwned").exists()
+
+
+class Evil:
+    def __init__(self, path):
+        self.path = path
+
+    def __reduce__(self):
+        return (os.mkdir, (self.path,))
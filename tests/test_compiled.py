@@ -0,0 +1,85 @@
+import io
+
+import pytest
+from fontTools.ttLib import TTFont
+from ufo2ft import compileOTF, compileTTF
+
+from flowify.compiled import flowify_compiled_font, font_from_binary
+
+
+def roundtrip(ttfont):
+    data = io.BytesIO()
+    ttfont.save(data)
+    data.seek(0)
+    return TTFont(data)
+
+
+# g0 and g4 are in the kerning groups, so this pair would be kerned by -40
+# if the zero didn't get in first.
+def font_with_zero_exception(make_font):
+    font = make_font()
+    font.kerning[("g0", "g4")] = 0
+    return font
+
+
+@pytest.mark.parametrize("compile", [compileTTF, compileOTF])
+def test_zero_exception_is_read(make_font, compile):
+    ttfont = compile(font_with_zero_exception(make_font))
+    font = font_from_binary(ttfont)
+    assert font.kerning[("g0", "g4")] == 0
+    assert [
+        value
+        for (l, r), value in font.kerning.items()
+        if "g1" in font.groups.get(l, []) and "g5" in font.groups.get(r, [])
+    ] == [-40]
+
+
+# With the class subtable first, it kerns every pair whose left glyph it
+# covers, and the pairs in the subtable after it never get a look in.
+def test_earlier_class_subtable_wins(make_font, corpus, shaper):
+    source = font_with_zero_exception(make_font)
+    source.kerning[("g1", "g9")] = 30
+    original = compileTTF(source)
+    original["GPOS"].table.LookupList.Lookup[0].SubTable.reverse()
+    original = roundtrip(original)
+    font = font_from_binary(original)
+    assert not [pair for pair in font.kerning if pair[0] in ("g0", "g1", "g2", "g3")]
+
+    flow = roundtrip(original)
+    flowify_compiled_font(flow)
+    original_shape, flow_shape = shaper(original), shaper(roundtrip(flow))
+    for text in corpus(source) + ["ae", "bj"]:
+        assert original_shape(text)[1] == flow_shape(text)[1], text
+
+
+@pytest.mark.parametrize("compile", [compileTTF, compileOTF])
+@pytest.mark.parametrize("options", [{}, {"kerning": "classes"}])
+def test_compiled_flow_font_keeps_widths(
+    make_font, corpus, shaper, compile, options
+):
+    source = font_with_zero_exception(make_font)
+    original = compile(source)
+    flow = roundtrip(original)
+    flowify_compiled_font(flow, **options)
+    flow = roundtrip(flow)
+    original_shape, flow_shape = shaper(original), shaper(flow)
+    texts = corpus(source) + ["ae", "ea ae"]
+    for text in texts:
+        assert original_shape(text)[1] == flow_shape(text)[1], text
+
+
+# Kerning in separate lookups adds up, including when a pair is kerned by a
+# class in one lookup and by itself in another.
+def test_kerning_lookups_add_up(make_font, shaper):
+    source = make_font()
+    source.features.text = """
+    lookup first { pos g8 g9 -50; pos [g0 g1] [g4 g5] -40; } first;
+    lookup second { pos g8 g9 -20; pos g0 g4 15; } second;
+    feature kern { lookup first; lookup second; } kern;
+    """
+    original = compileTTF(source, featureWriters=[])
+    flow = roundtrip(original)
+    flowify_compiled_font(flow)
+    original_shape, flow_shape = shaper(original), shaper(roundtrip(flow))
+    for text in ["ij", "ae", "bf", "af", "ji", "aij"]:
+        assert original_shape(text)[1] == flow_shape(text)[1], text
@@ -0,0 +1,33 @@
+import pytest
+from ufo2ft import compileTTF
+
+from flowify import Flowify
+
+
+# Encodings are remembered, so changing what encode() hands back mustn't
+# change what the next caller gets.
+def test_encode_hands_out_copies(make_font):
+    flowify = Flowify(make_font())
+    first = flowify.encode(553)
+    expected = [list(glyph) for glyph in first]
+    first[0].append("slug.left")
+    first.append(["_end"])
+    assert flowify.encode(553) == expected
+    assert flowify.encode(553)[0] is not flowify.encode(553)[0]
+
+
+# Encoding by width must add up to the same advances as encoding each glyph.
+@pytest.mark.parametrize(
+    "options", [{}, {"no_blank": True}, {"kerning": "classes"}, {"output": "binary"}]
+)
+def test_width_encoding_keeps_widths(make_font, corpus, shaper, options):
+    font = make_font()
+    texts = corpus(font)
+    original = shaper(compileTTF(make_font()))
+    flowify = Flowify(font, encoding="width", **options)
+    ttfont = compileTTF(font)
+    if options.get("output") == "binary":
+        flowify.add_to_binary_font(ttfont)
+    flow = shaper(ttfont)
+    for text in texts:
+        assert flow(text)[1] == original(text)[1], text
@@ -0,0 +1,27 @@
+import pytest
+from ufo2ft import compileTTF
+
+from flowify import Flowify
+
+
+# A dry run's estimate of GSUB should err on the large side, but not by much.
+# (The compiler shares identical tables between lookups, which the estimate
+# doesn't try to follow, so lots of small lookups come out further over.)
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"kerning": "classes"},
+        {"max_kern_rules_per_lookup": "auto"},
+        {"kerning": "classes", "max_kern_rules_per_lookup": 20},
+    ],
+)
+def test_estimate_is_close(make_font, options):
+    estimate = Flowify(make_font(kern_pairs=400), dry_run=True, **options).estimate()
+    font = make_font(kern_pairs=400)
+    flowify = Flowify(font, output="binary", **options)
+    ttfont = compileTTF(font)
+    flowify.add_to_binary_font(ttfont)
+    real = len(ttfont.getTableData("GSUB"))
+    assert real <= estimate["gsub_bytes"] <= real * 1.75
+    assert estimate["lookups"] == len(ttfont["GSUB"].table.LookupList.Lookup)
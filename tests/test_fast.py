@@ -0,0 +1,25 @@
+import pytest
+from ufo2ft import compileTTF
+
+from flowify import Flowify
+
+
+# The fast engine can't blank out words or do debugging arithmetic, so it
+# mustn't quietly build something else when asked to.
+@pytest.mark.parametrize(
+    "options",
+    [{}, {"no_blank": True, "debugging": True}],
+)
+def test_fast_engine_rejects_what_it_cant_do(make_font, options):
+    with pytest.raises(ValueError):
+        Flowify(make_font(), engine="fast", shape="rectangle", **options)
+
+
+def test_fast_engine_keeps_widths(make_font, corpus, shaper):
+    font = make_font()
+    texts = corpus(font)
+    original = shaper(compileTTF(make_font()))
+    Flowify(font, engine="fast", shape="rectangle", no_blank=True)
+    flow = shaper(compileTTF(font))
+    for text in texts:
+        assert flow(text)[1] == original(text)[1], text
@@ -0,0 +1,40 @@
+from ufo2ft import compileTTF
+from ufoLib2 import Font
+
+from flowify import FlowifyFilter
+
+
+# fontmake compiles the filter's glyph set rather than the font, so that is
+# where a subset has to take effect.
+def test_filter_subset(make_font):
+    ttfont = compileTTF(make_font(), filters=[FlowifyFilter(pre=True, subset="U+61-62")])
+    cmap = ttfont.getBestCmap()
+    assert sorted(cmap) == [0x61, 0x62]
+    glyf = ttfont["glyf"]
+    assert glyf["g0"].numberOfContours == 1
+    assert glyf["g5"].numberOfContours == 0
+
+
+# Every master of a family gets its own feature file, and its include()
+# finds it from wherever the UFO is.
+def test_filter_fea_path_per_master(make_font, shaper, corpus, tmp_path):
+    (tmp_path / "masters").mkdir()
+    paths = []
+    for seed in (1, 2):
+        path = str(tmp_path / "masters" / ("Test-%i.ufo" % seed))
+        make_font(seed=seed).save(path)
+        paths.append(path)
+    fonts = [Font.open(path) for path in paths]
+    flowify = FlowifyFilter(pre=True, fea_path=str(tmp_path / "flow.fea"))
+    for font in fonts:
+        flowify(font)
+    assert sorted(p.name for p in tmp_path.glob("*.fea")) == [
+        "flow-Test-1.fea",
+        "flow-Test-2.fea",
+    ]
+    texts = corpus(make_font())
+    for seed, font in zip((1, 2), fonts):
+        original = shaper(compileTTF(make_font(seed=seed)))
+        flow = shaper(compileTTF(font))
+        for text in texts:
+            assert flow(text)[1] == original(text)[1], text
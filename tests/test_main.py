@@ -0,0 +1,21 @@
+from ufo2ft import compileTTF
+from ufoLib2 import Font
+
+from flowify.main import main
+
+
+# With --separate-fea the include() has to find the feature file from where
+# the output UFO is, not the input.
+def test_separate_fea_elsewhere(make_font, shaper, corpus, tmp_path):
+    source = tmp_path / "sources" / "masters"
+    source.mkdir(parents=True)
+    (tmp_path / "out").mkdir()
+    make_font().save(str(source / "Test.ufo"))
+    output = str(tmp_path / "out" / "TestFlow.ufo")
+    main(["--separate-fea", str(source / "Test.ufo"), output])
+    assert (tmp_path / "out" / "TestFlow.fea").exists()
+    texts = corpus(make_font())
+    original = shaper(compileTTF(make_font()))
+    flow = shaper(compileTTF(Font.open(output)))
+    for text in texts:
+        assert flow(text)[1] == original(text)[1], text
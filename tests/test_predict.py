@@ -0,0 +1,51 @@
+import json
+
+import pytest
+from ufo2ft import compileTTF
+
+from flowify import Flowify
+from flowify.predict import SlugLayout
+
+
+# SlugLayout.predict() should agree with HarfBuzz shaping the flow font about
+# the advance width of every text, and how many pills and blanks are in it.
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"no_blank": True},
+        {"output": "binary"},
+        {"kerning": "classes", "kern_grid": 10},
+        {"shape": "rectangle"},
+        {"pipeline": "fused"},
+    ],
+)
+def test_prediction_matches_shaping(make_font, corpus, shaper, options):
+    pytest.importorskip("numpy")
+    texts = corpus(make_font())
+    original = shaper(compileTTF(make_font()))
+    sequences = [original(text)[0] for text in texts]
+
+    font = make_font()
+    flowify = Flowify(font, **options)
+    ttfont = compileTTF(font)
+    if options.get("output") == "binary":
+        flowify.add_to_binary_font(ttfont)
+    shape = shaper(ttfont)
+
+    # It should survive a trip through JSON, too
+    layout = SlugLayout.from_dict(json.loads(flowify.slug_layout().as_json()))
+    predicted = layout.predict(sequences)
+    pills = [0] * len(texts)
+    blanks = [0] * len(texts)
+    for sequence, kind in zip(predicted["word_sequence"], predicted["shape"]):
+        if kind == "pill":
+            pills[sequence] += 1
+        elif kind == "blank":
+            blanks[sequence] += 1
+
+    for i, text in enumerate(texts):
+        glyphs, advance = shape(text)
+        assert predicted["advance"][i] == advance, text
+        assert glyphs.count("slug.left") == pills[i], text
+        assert sum(g.endswith("E0.blank") for g in glyphs) == blanks[i], text
@@ -0,0 +1,19 @@
+import json
+
+from flowify import Flowify
+
+
+# Every pair that quantizing moves should be listed with how far it moved, in
+# the statistics as well as on the Flowify object.
+def test_kern_errors_per_pair(make_font):
+    font = make_font()
+    flowify = Flowify(font, kern_grid=20, stats=True)
+    expected = {}
+    for pair, value in font.kerning.items():
+        if value % 20:
+            expected[pair] = abs(round(value / 20) * 20 - value)
+    assert expected
+    assert flowify.kern_errors == expected
+    stats = json.loads(flowify.stats.as_json())["counts"]
+    assert stats["kern_errors"] == {"%s %s" % p: e for p, e in expected.items()}
+    assert stats["kern_error_max"] == max(expected.values())